@@ -0,0 +1,420 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Union, List, Optional
+from neo4j import AsyncGraphDatabase, READ_ACCESS, WRITE_ACCESS
+from neo4j.exceptions import Neo4jError
+
+from db import Neo4jDB, SCHEMA, COPY_READ_QUERY
+
+
+class AsyncNeo4jDB:
+    """
+    Neo4jDB 的异步版本，只包含摄取所需的方法：节点 / 关系的读写、批量写入、模式和事务，
+    均为协程，与 Neo4jDB 同名同参，语句构建和结果转换复用 Neo4jDB；
+    可与 pydriller 提取、LLM 请求等其他 I/O 在同一事件循环中重叠执行
+
+    事务外的调用可以并发（各自占用会话，受 max_in_flight 限制）；
+    unit_of_work / write_transaction 内的语句须在同一任务中依次 await
+    """
+
+    def __init__(
+        self,
+        uri: str = "neo4j://localhost:7687",
+        user: str = "neo4j",
+        password: str = "12345678",
+        database: str = None,
+        batch_size: int = 1000,
+        max_in_flight: int = 16,
+        max_connection_pool_size: int = None,
+    ):
+        """
+        :param database: 数据库名称（可选，社区版不需要）
+        :param batch_size: 批量写入时每条语句的行数
+        :param max_in_flight: 同时进行的事务数上限，超出的协程等待
+        :param max_connection_pool_size: 连接池大小，默认与 max_in_flight 相同，
+            每个进行中的事务占用一个连接，不应小于 max_in_flight
+        """
+        self._driver = AsyncGraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=max_connection_pool_size or max_in_flight,
+        )
+        self._database = database
+        self.batch_size = batch_size
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        # (任务, 事务)：当前任务正在使用的事务，存在时所有操作都通过该事务执行；
+        # 与 Neo4jDB 的线程局部变量对应。子任务会继承该值，见 _current_tx
+        self._tx = ContextVar(f"tx_{id(self)}", default=None)
+
+    def _current_tx(self):
+        """
+        当前任务的事务，没有时返回 None
+
+        驱动的异步事务不支持并发执行语句，事务只能在开启它的任务中顺序使用；
+        在 unit_of_work / write_transaction 中通过 asyncio.gather 等创建的子任务
+        继承了事务却不能使用，此时报错而不是并发执行或悄悄脱离事务
+        """
+        entry = self._tx.get()
+        if entry is None:
+            return None
+        task, tx = entry
+        if task is not asyncio.current_task():
+            raise RuntimeError(
+                "the transaction of unit_of_work / write_transaction can only be used "
+                "by the task that opened it, await its statements sequentially"
+            )
+        return tx
+
+    async def close(self):
+        await self._driver.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @asynccontextmanager
+    async def _session(self, **kwargs):
+        """占用一个事务名额并打开会话"""
+        async with self._in_flight:
+            async with self._driver.session(database=self._database, **kwargs) as session:
+                yield session
+
+    async def execute_query(self, query: str, parameters: dict = None, **kwargs) -> list:
+        """
+        执行Cypher查询的通用方法
+
+        :param query: Cypher查询语句
+        :param parameters: 查询参数字典
+        :return: 查询结果的全部记录
+        """
+        parameters = parameters or {}
+        tx = self._current_tx()
+        if tx:
+            result = await tx.run(query, parameters, **kwargs)
+            return [record async for record in result]
+        async with self._session() as session:
+            result = await session.run(query, parameters, **kwargs)
+            return [record async for record in result]
+
+    async def stream_query(
+        self,
+        query: str,
+        parameters: dict = None,
+        fetch_size: int = 1000,
+        read: bool = True,
+    ):
+        """
+        惰性逐条读取查询结果（异步生成器），参数同 Neo4jDB.stream_query
+
+        :return: 记录字典，其中的节点和关系已转换为字典
+        """
+        parameters = parameters or {}
+        tx = self._current_tx()
+        if tx:
+            async for record in await tx.run(query, parameters):
+                yield Neo4jDB._convert_record(record)
+            return
+        async with self._session(
+            fetch_size=fetch_size,
+            default_access_mode=READ_ACCESS if read else WRITE_ACCESS,
+        ) as session:
+            async for record in await session.run(query, parameters):
+                yield Neo4jDB._convert_record(record)
+
+    async def setup_schema(self, schema: List[str] = SCHEMA):
+        """创建 MERGE 键属性的唯一约束和索引（幂等），见 Neo4jDB.setup_schema"""
+        async with self._session() as session:
+            for statement in schema:
+                try:
+                    await (await session.run(statement)).consume()
+                except Neo4jError as e:
+                    print(f"schema setup failed: {statement}\n{e}")
+            await (await session.run("CALL db.awaitIndexes(300)")).consume()
+
+    async def create_node(
+        self, labels: Union[str, List[str]], properties: dict = None
+    ) -> dict:
+        """创建节点"""
+        query = Neo4jDB._create_node_query(labels)
+        result = await self.execute_query(query, {"props": properties or {}})
+        return Neo4jDB._convert_node(result[0]["n"])
+
+    async def merge_node(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        key_props: List[str] = None,
+    ) -> dict:
+        """合并节点：只按键属性 MERGE，其余属性通过 SET 写入"""
+        if isinstance(labels, str):
+            labels = [labels]
+        properties = properties or {}
+        cypher = Neo4jDB._merge_query(labels, key_props, "$props", properties) + " RETURN n"
+        result = await self.execute_query(cypher, {"props": properties})
+        return Neo4jDB._convert_node(result[0]["n"])
+
+    async def merge_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: Optional[List[str]],
+        rows: List[dict],
+        batch_size: int = None,
+    ) -> List[str]:
+        """批量合并节点，见 Neo4jDB.merge_nodes_bulk"""
+        if not rows:
+            return []
+        query = Neo4jDB._merge_nodes_bulk_query(labels, key_props, rows[0])
+        return await self._write_batches(
+            query, [{"props": row} for row in rows], batch_size
+        )
+
+    async def increment_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: List[str],
+        rows: List[dict],
+        max_props: List[str] = None,
+        batch_size: int = None,
+    ) -> List[str]:
+        """批量累加计数节点，见 Neo4jDB.increment_nodes_bulk"""
+        if not rows:
+            return []
+        query = Neo4jDB._increment_nodes_bulk_query(labels, key_props, rows[0], max_props)
+        return await self._write_batches(
+            query, [{"props": row} for row in rows], batch_size
+        )
+
+    async def create_nodes_bulk(
+        self, labels: Union[str, List[str]], rows: List[dict], batch_size: int = None
+    ) -> List[str]:
+        """批量创建节点，见 Neo4jDB.create_nodes_bulk"""
+        query = Neo4jDB._create_nodes_bulk_query(labels)
+        return await self._write_batches(
+            query, [{"props": row} for row in rows], batch_size
+        )
+
+    async def match_nodes(
+        self, labels: Union[str, List[str]], properties: dict = None, limit: int = None
+    ) -> list[dict]:
+        """查找匹配条件的节点"""
+        return [node async for node in self.iter_nodes(labels, properties, limit)]
+
+    async def iter_nodes(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        """流式查找匹配条件的节点（异步生成器）"""
+        query = Neo4jDB._match_nodes_query(labels, properties, limit)
+        async for record in self.stream_query(query, properties, fetch_size):
+            yield record["n"]
+
+    async def existing_keys(
+        self, label: str, key_prop: str, required_prop: str = None, values: list = None
+    ) -> set:
+        """键属性值集合，见 Neo4jDB.existing_keys"""
+        query = Neo4jDB._existing_keys_query(label, key_prop, required_prop, values is not None)
+        return {
+            record["key"] async for record in self.stream_query(query, {"values": values})
+        }
+
+    async def create_relationship(
+        self, from_id: str, to_id: str, rel_type: str, properties: dict = None
+    ) -> dict:
+        """创建两个节点之间的关系"""
+        query = Neo4jDB._create_relationship_query(rel_type)
+        result = await self.execute_query(
+            query, {"from_id": from_id, "to_id": to_id, "props": properties or {}}
+        )
+        return Neo4jDB._convert_relationship(result[0]["r"])
+
+    async def create_relationships_bulk(
+        self, rel_type: str, rows: List[dict], batch_size: int = None, merge: bool = False
+    ) -> List[Optional[str]]:
+        """批量创建关系，见 Neo4jDB.create_relationships_bulk"""
+        query = Neo4jDB._create_relationships_bulk_query(rel_type, merge)
+        return await self._write_batches(
+            query, Neo4jDB._relationship_rows(rows), batch_size
+        )
+
+    async def _write_batches(
+        self, query: str, rows: List[dict], batch_size: int = None
+    ) -> List[Optional[str]]:
+        """分批执行 UNWIND 写入语句，按 row.i 还原输入顺序"""
+        element_ids = [None] * len(rows)
+        if not rows:
+            return element_ids
+
+        async def write(tx, batch):
+            result = await tx.run(query, rows=batch)
+            return [(r["i"], r["element_id"]) async for r in result]
+
+        batches = Neo4jDB._batches(rows, batch_size or self.batch_size)
+        tx = self._current_tx()
+        if tx:
+            results = [await write(tx, batch) for batch in batches]
+        else:
+            async with self._session() as session:
+                results = [await session.execute_write(write, batch) for batch in batches]
+        for result in results:
+            for i, element_id in result:
+                element_ids[i] = element_id
+        return element_ids
+
+    async def find_relationships(
+        self,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+    ) -> List[dict]:
+        """查找匹配条件的关系（支持多标签节点）"""
+        return [
+            rel
+            async for rel in self.iter_relationships(
+                from_labels, to_labels, rel_type, properties, limit
+            )
+        ]
+
+    async def iter_relationships(
+        self,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        """流式查找匹配条件的关系（异步生成器），参数同 find_relationships"""
+        query = Neo4jDB._find_relationships_query(
+            from_labels, to_labels, rel_type, properties, limit
+        )
+        async for record in self.stream_query(query, properties, fetch_size):
+            yield {
+                "relationship": record["r"],
+                "from_node": record["a"],
+                "to_node": record["b"],
+            }
+
+    async def update_node(
+        self,
+        element_id: str,
+        properties: dict,
+        add_labels: List[str] = None,
+        remove_labels: List[str] = None,
+    ) -> dict:
+        """更新节点属性和标签"""
+        query = Neo4jDB._update_node_query(properties, add_labels, remove_labels)
+        result = await self.execute_query(
+            query, {"element_id": element_id, "props": properties or {}}
+        )
+        return Neo4jDB._convert_node(result[0]["n"])
+
+    async def delete_node(self, element_id: str):
+        """删除节点及其所有关系"""
+        query = "MATCH (n) WHERE elementId(n) = $element_id DETACH DELETE n"
+        await self.execute_query(query, {"element_id": element_id})
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """
+        在同一显式写事务中执行 async with 语句块内的所有操作，
+        正常退出时提交一次，出现异常时回滚；嵌套使用时并入外层事务
+
+        async with db.unit_of_work():
+            await db.merge_node(...)
+            await db.create_relationship(...)
+        """
+        if self._current_tx():
+            yield self
+            return
+        async with self._session() as session:
+            tx = await session.begin_transaction()
+            token = self._tx.set((asyncio.current_task(), tx))
+            try:
+                yield self
+            except BaseException:
+                await tx.rollback()
+                raise
+            else:
+                await tx.commit()
+            finally:
+                self._tx.reset(token)
+
+    async def write_transaction(self, work: Callable[..., Awaitable], *args, **kwargs):
+        """
+        通过 execute_write 执行 await work(self, *args, **kwargs)，期间所有操作都走同一事务，
+        遇到瞬时错误时整体重试，因此 work 应可重复执行
+
+        :param work: 工作协程函数，第一个参数为本对象
+        :return: work 的返回值
+        """
+        if self._current_tx():
+            return await work(self, *args, **kwargs)
+
+        async def run(tx):
+            token = self._tx.set((asyncio.current_task(), tx))
+            try:
+                return await work(self, *args, **kwargs)
+            finally:
+                self._tx.reset(token)
+
+        async with self._session() as session:
+            return await session.execute_write(run)
+
+    async def copy_node_and_relations(self, element_id: str, update_props: dict = None):
+        """复制节点标签、属性、相连关系，见 Neo4jDB.copy_node_and_relations"""
+        tx = self._current_tx()
+        if tx:
+            return Neo4jDB._convert_node(
+                await self._copy_node_and_relations(tx, element_id, update_props)
+            )
+        async with self._session() as session:
+            result = await session.execute_write(
+                self._copy_node_and_relations, element_id, update_props
+            )
+            return Neo4jDB._convert_node(result)
+
+    @staticmethod
+    async def _copy_node_and_relations(tx, element_id: str, update_props: dict = None):
+        record = await (await tx.run(COPY_READ_QUERY, element_id=element_id)).single()
+        if not record:
+            raise ValueError(f"Node with elementId {element_id} not found")
+        query, new_props = Neo4jDB._copy_node_query(record["n"], update_props)
+        new_node = (await (await tx.run(query, properties=new_props)).single())["n"]
+        for query, rows in Neo4jDB._copy_rel_queries(record):
+            await (
+                await tx.run(query, new_element_id=new_node.element_id, rows=rows)
+            ).consume()
+        return new_node
+
+
+if __name__ == "__main__":
+
+    async def main():
+        async with AsyncNeo4jDB(max_in_flight=8) as db:
+            # 并发写入，同时进行的事务数受 max_in_flight 限制
+            nodes = await asyncio.gather(
+                *[db.merge_node("Person", {"name": f"Person {i}"}) for i in range(20)]
+            )
+            print(len(nodes), "nodes merged")
+
+            async def knows(db, a, b):
+                await db.create_relationship(a, b, "KNOWS", {"since": "1989"})
+                return await db.find_relationships("Person", "Person", "KNOWS", limit=5)
+
+            print(
+                await db.write_transaction(
+                    knows, nodes[0]["element_id"], nodes[1]["element_id"]
+                )
+            )
+            for node in nodes:
+                await db.delete_node(node["element_id"])
+
+    asyncio.run(main())
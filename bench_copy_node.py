@@ -0,0 +1,105 @@
+"""usage: python bench_copy_node.py [DEGREE ...] [--memory]
+
+Time `copy_node_and_relations` on a FileChange node with DEGREE outgoing
+`ADD_FEAT` / `MODIFY_FEAT` relationships plus incoming `*_FILE` ones, against
+the previous one-statement-per-relationship copy. Needs a running Neo4j
+unless `--memory` is given.
+"""
+from sys import argv
+from time import perf_counter
+
+from db import Neo4jDB
+from memdb import MemoryGraphDB
+
+LABEL = "BenchCopy"
+
+
+def build_node(db, degree: int):
+    """FileChange node with `degree` features and `degree // 10 + 1` commits"""
+    fc = db.create_node([LABEL, "FileChange"], {"file_name": "bench.py", "change_type": "ADD"})
+    fcid = fc["element_id"]
+    feat_ids = db.create_nodes_bulk(
+        [LABEL, "Feature"], [{"name": f"feat {i}", "ident": "x" * 64} for i in range(degree)]
+    )
+    commit_ids = db.create_nodes_bulk(
+        [LABEL, "Commit"], [{"name": f"commit {i}"} for i in range(degree // 10 + 1)]
+    )
+    db.create_relationships_bulk(
+        "ADD_FEAT", [{"from_id": fcid, "to_id": f} for f in feat_ids[::2]]
+    )
+    db.create_relationships_bulk(
+        "MODIFY_FEAT", [{"from_id": fcid, "to_id": f} for f in feat_ids[1::2]]
+    )
+    db.create_relationships_bulk(
+        "MODIFY_FILE", [{"from_id": c, "to_id": fcid, "properties": {"date": "d"}} for c in commit_ids]
+    )
+    return fcid
+
+
+def naive_copy(tx, element_id: str, update_props: dict):
+    """previous implementation: one `tx.run` per relationship"""
+    node = tx.run("MATCH (n) WHERE elementId(n) = $id RETURN n", id=element_id).single()["n"]
+    new_props = dict(node, **update_props)
+    new = tx.run(
+        f"CREATE (n:{':'.join(node.labels)} $props) RETURN n", props=new_props
+    ).single()["n"]
+    for direction in ("out", "in"):
+        pattern = "(n)-[r]->(m)" if direction == "out" else "(m)-[r]->(n)"
+        rels = list(
+            tx.run(
+                f"MATCH {pattern} WHERE elementId(n) = $id "
+                "RETURN type(r) AS t, properties(r) AS p, elementId(m) AS m",
+                id=element_id,
+            )
+        )
+        for rel in rels:
+            create = "(a)-[r:{}]->(b)" if direction == "out" else "(b)-[r:{}]->(a)"
+            tx.run(
+                "MATCH (a), (b) WHERE elementId(a) = $a AND elementId(b) = $b "
+                f"CREATE {create.format(rel['t'])} SET r = $p",
+                a=new.element_id,
+                b=rel["m"],
+                p=rel["p"],
+            ).consume()
+    return new
+
+
+def bench(db, degree: int):
+    fcid = build_node(db, degree)
+    update = {"file_name": "renamed.py", "change_type": "RENAME"}
+    start = perf_counter()
+    db.copy_node_and_relations(fcid, update)
+    elapsed = perf_counter() - start
+    naive = None
+    if isinstance(db, Neo4jDB):
+        start = perf_counter()
+        with db._driver.session(database=db._database) as session:
+            session.execute_write(naive_copy, fcid, update)
+        naive = perf_counter() - start
+    return elapsed, naive
+
+
+def cleanup(db):
+    if isinstance(db, Neo4jDB):
+        db.execute_query(f"MATCH (n:{LABEL}) DETACH DELETE n")
+    else:
+        for node in db.match_nodes(LABEL):
+            db.delete_node(node["element_id"])
+
+
+if __name__ == "__main__":
+    memory = "--memory" in argv
+    degrees = [int(a) for a in argv[1:] if a.isdigit()] or [10, 100, 1000, 5000]
+    db = MemoryGraphDB() if memory else Neo4jDB()
+    try:
+        print(f"{'degree':>8} {'copy (s)':>10} {'naive (s)':>10} {'speedup':>8}")
+        for degree in degrees:
+            elapsed, naive = bench(db, degree)
+            cleanup(db)
+            if naive is None:
+                print(f"{degree:>8} {elapsed:>10.4f}")
+            else:
+                print(f"{degree:>8} {elapsed:>10.4f} {naive:>10.4f} {naive / elapsed:>7.1f}x")
+    finally:
+        cleanup(db)
+        db.close()
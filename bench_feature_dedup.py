@@ -0,0 +1,81 @@
+"""usage: python bench_feature_dedup.py [THRESHOLD]
+
+Run `feature_dedup.find_clusters` on every knowledge JSON in `commits/` and
+compare its candidate generation with the exact all-pairs comparison:
+`recall` is the share of feature pairs at or above THRESHOLD that MinHash/LSH
+turned into candidates, `features` after consolidation counts one node per
+cluster.
+"""
+import glob
+import json
+import re
+from itertools import combinations
+from os import path, chdir
+from sys import argv
+from time import perf_counter
+
+from feature_dedup import (
+    THRESHOLD,
+    MinHasher,
+    feature_key,
+    find_clusters,
+    jaccard,
+    knowledge_features,
+    lsh_candidates,
+    shingles,
+)
+
+# sidecars written next to a knowledge JSON, e.g. `<JSON_NAME>.meta.json`
+SIDECAR = re.compile(r"\.[a-z]+\.json$")
+
+
+def bench(knowledge: dict, threshold: float):
+    features = list(knowledge_features(knowledge))
+    start = perf_counter()
+    clusters, n_candidates = find_clusters(features, threshold)
+    lsh_time = perf_counter() - start
+
+    unique = {feature_key(name, ident): ident for name, ident in features}
+    sets = [shingles(key[0], ident) for key, ident in unique.items()]
+    start = perf_counter()
+    exact = {
+        (i, j)
+        for i, j in combinations(range(len(sets)), 2)
+        if jaccard(sets[i], sets[j]) >= threshold
+    }
+    exact_time = perf_counter() - start
+    hasher = MinHasher()
+    found = lsh_candidates([hasher.signature(s) for s in sets])
+    recall = len(exact & found) / len(exact) if exact else 1.0
+    clustered = sum(len(c) for c in clusters)
+    return {
+        "occurrences": len(features),
+        "unique": len(unique),
+        "candidates": n_candidates,
+        "pairs": len(unique) * (len(unique) - 1) // 2,
+        "lsh_time": lsh_time,
+        "exact_time": exact_time,
+        "recall": recall,
+        "clusters": len(clusters),
+        "after": len(unique) - clustered + len(clusters),
+    }
+
+
+if __name__ == "__main__":
+    chdir(path.dirname(path.abspath(__file__)))
+    threshold = float(argv[1]) if len(argv) > 1 else THRESHOLD
+    print(
+        f"{'repo':<36} {'feats':>6} {'unique':>6} {'cands':>7} {'pairs':>8} "
+        f"{'lsh (s)':>8} {'exact (s)':>9} {'recall':>7} {'clusters':>8} {'after':>6}"
+    )
+    for fname in sorted(glob.glob(path.join("commits", "*.json"))):
+        if SIDECAR.search(fname):
+            continue
+        with open(fname) as f:
+            r = bench(json.load(f), threshold)
+        repo = path.basename(fname).split("_")[0][:36]
+        print(
+            f"{repo:<36} {r['occurrences']:>6} {r['unique']:>6} {r['candidates']:>7} "
+            f"{r['pairs']:>8} {r['lsh_time']:>8.3f} {r['exact_time']:>9.3f} "
+            f"{r['recall']:>7.1%} {r['clusters']:>8} {r['after']:>6}"
+        )
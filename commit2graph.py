@@ -1,17 +1,78 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, Literal
-import json
-from os import path, chdir
+from typing import Dict, Iterable, Literal
+from os import path, chdir, getenv
 
 from pydriller import Repository
-from pydriller.domain.commit import ModificationType, Commit, Developer
 
+from commit_index import CommitIndex
+from commit_meta import commit_record, get_commit_properties, load_meta
+from aggregates import refresh_aggregates
 from db import Neo4jDB
+from feature_dedup import THRESHOLD, canonical_for, feature_key
+from features import feat_list, file_add, file_del, file_mod, chk_no_in_str
+from knowledge_index import KnowledgeIndex
+from lineage import PathLineage
+from memdb import MemoryGraphDB
+from pipeline import run_pipeline, batched
 
-n4jdb = Neo4jDB()
+FEAT_RELS = {"add": "ADD_FEAT", "delete": "DELETE_FEAT", "modify": "MODIFY_FEAT"}
 
 
-def travese_commits(repo_path: str, knowledge: Dict[str, object], num_limit: int = -1):
+def open_db():
+    """GRAPH_BACKEND=memory builds the graph in process, e.g. for dry runs and profiling"""
+    if getenv("GRAPH_BACKEND") == "memory":
+        return MemoryGraphDB()
+    # repeated merges of the same users and parent commits resolve locally
+    return Neo4jDB(identity_cache_size=100_000)
+
+
+def travese_commits(
+    db: Neo4jDB,
+    repo_path: str,
+    knowledge: Dict[str, object],
+    num_limit: int = -1,
+    commits_per_tx: int = 1,
+    queue_size: int = 64,
+    lineage: PathLineage = None,
+    canonical: dict = None,
+    resume: bool = False,
+):
+    """
+    ingest the analysed commits of the repository at `repo_path`, see `ingest`;
+    with `resume` commits already in the graph are skipped (`skip_ingested`)
+    """
+    if resume:
+        knowledge = skip_ingested(db, knowledge)
+    return ingest(
+        db,
+        git_records(repo_path, knowledge, num_limit),
+        knowledge,
+        commits_per_tx,
+        queue_size,
+        lineage,
+        canonical,
+        merge_rels=resume,
+    )
+
+
+def skip_ingested(db: Neo4jDB, knowledge: Dict[str, object]) -> Dict[str, object]:
+    """
+    `knowledge` without the commits already ingested, fetched in one query;
+    parents are merged as bare `{name}` nodes, so only commits with their
+    properties count. Each commit is written in one transaction, a commit
+    node with properties comes with its whole subgraph
+    """
+    done = db.existing_keys("Commit", "name", "committer_date")
+    pending = [h for h in knowledge if h not in done]
+    print(f"{len(knowledge) - len(pending)} commits already ingested, {len(pending)} to go")
+    if isinstance(knowledge, KnowledgeIndex):
+        return knowledge.subset(pending)
+    return {h: knowledge[h] for h in pending}
+
+
+def git_records(repo_path: str, knowledge: Dict[str, object], num_limit: int = -1):
+    index = CommitIndex(repo_path)
     cnt = 0
     for commit in Repository(repo_path).traverse_commits():
         if cnt == num_limit:
@@ -19,110 +80,230 @@ def travese_commits(repo_path: str, knowledge: Dict[str, object], num_limit: int
         cnt += 1
         if not commit.hash in knowledge:
             continue
-        commit_knowledge = knowledge[commit.hash]
         print("handling", commit.hash, cnt)
-        # create node
-        commit_node = n4jdb.merge_node("Commit", get_commit_properties(commit))
-        commit_element_id = commit_node["element_id"]
-        # create parents
-        for parent in commit.parents:
-            parent_node = n4jdb.merge_node(
-                "Commit",
-                {"name": parent},
-            )
-            _ = n4jdb.create_relationship(
-                parent_node["element_id"], commit_element_id, "PARENT_OF"
-            )
-            _ = n4jdb.create_relationship(
-                commit_element_id, parent_node["element_id"], "CHILD_OF"
+        yield commit_record(commit, index)
+
+
+def ingest(
+    db: Neo4jDB,
+    records: Iterable[dict],
+    knowledge: Dict[str, object],
+    commits_per_tx: int = 1,
+    queue_size: int = 64,
+    lineage: PathLineage = None,
+    canonical: dict = None,
+    merge_rels: bool = False,
+):
+    """
+    extract -> transform -> write pipeline, each stage in its own thread with
+    `queue_size` items buffered in between, so git and database latency overlap;
+    each `commits_per_tx` commits are written atomically in one transaction;
+    a commit that fails to write is logged and skipped
+
+    `records` are commit records in traversal order, from git (`git_records`)
+    or from a metadata sidecar (`commit_meta.load_meta`); `lineage` is updated
+    with the file changes of every written commit; features in `canonical`
+    (`feature_dedup.consolidate`) are linked to their CanonicalFeature;
+    records without knowledge are skipped. `merge_rels` MERGEs relationships
+    instead of creating them, so writing a commit again adds no duplicate edges
+    """
+    lineage = PathLineage() if lineage is None else lineage
+
+    def transform(records):
+        for record in records:
+            if record["commit"]["name"] in knowledge:
+                yield commit_subgraph(record, knowledge[record["commit"]["name"]])
+
+    def write_batch(batch: list[dict]):
+        db.write_transaction(
+            write_subgraphs, batch, lineage, canonical, merge_rels
+        ).commit()
+
+    def write(subgraphs):
+        for batch in batched(subgraphs, commits_per_tx):
+            try:
+                write_batch(batch)
+                yield from batch
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    print(f"skipping commit {batch[0]['commit']['name']}: {e}")
+                    continue
+            # one bad commit must not take the others of its transaction with it
+            for subgraph in batch:
+                try:
+                    write_batch([subgraph])
+                    yield subgraph
+                except Exception as e:
+                    print(f"skipping commit {subgraph['commit']['name']}: {e}")
+
+    return run_pipeline(
+        ("extract", records),
+        ("transform", transform),
+        ("write", write),
+        maxsize=queue_size,
+    )
+
+
+def write_subgraphs(
+    db: Neo4jDB,
+    subgraphs: list[dict],
+    lineage: PathLineage,
+    canonical: dict = None,
+    merge_rels: bool = False,
+):
+    """
+    unit of work for `Neo4jDB.write_transaction`, may be retried as a whole
+
+    lineage changes go to a child of `lineage`, returned for the caller to
+    commit once the transaction has; the aggregates of `aggregates.py` are
+    refreshed in the same transaction, with the commits not in the graph
+    before only: aggregates are increments, commits are merged
+    """
+    # parents are merged as bare `{name}` nodes, see `skip_ingested`
+    ingested = db.existing_keys(
+        "Commit", "name", "committer_date", [s["commit"]["name"] for s in subgraphs]
+    )
+    pending = lineage.child()
+    for subgraph in subgraphs:
+        write_subgraph(db, subgraph, pending, canonical, merge_rels)
+    new = [s for s in subgraphs if s["commit"]["name"] not in ingested]
+    refresh_aggregates(db, new, canonical)
+    return pending
+
+
+def commit_subgraph(record: dict, commit_knowledge: Dict[str, object]):
+    """plain description of the nodes and relationships a commit record adds to the graph"""
+    commit = record["commit"]
+    date = commit["committer_date"]
+    file_changes = []
+    for file in record["modified_files"]:
+        match file["change_type"]:
+            case "ADD":
+                fname = file["new_path"]
+                if not fname in commit_knowledge:
+                    continue
+                file_changes.append(
+                    file_change(fname, "ADD", date, file_add(commit_knowledge[fname]))
+                )
+            case "RENAME":
+                file_changes.append(
+                    file_change(file["new_path"], "RENAME", date, old_path=file["old_path"])
+                )
+            case "DELETE":
+                fname = file["old_path"]
+                if not fname in commit_knowledge:
+                    continue
+                file_changes.append(
+                    file_change(fname, "DELETE", date, file_del(commit_knowledge[fname]))
+                )
+            case "MODIFY":
+                fname = file["old_path"]
+                if not fname in commit_knowledge:
+                    continue
+                file_changes.append(
+                    file_change(fname, "MODIFY", date, file_mod(commit_knowledge[fname]))
+                )
+    return {
+        "commit": commit,
+        "parents": list(commit["parents"]),
+        "users": user_commit(
+            {"name": commit["author_name"], "email": commit["author_email"]},
+            {"name": commit["committer_name"], "email": commit["committer_email"]},
+            commit["author_date"],
+            date,
+        ),
+        "file_changes": file_changes,
+    }
+
+
+def file_change(
+    fname: str, change_type: str, date: datetime, features: list = None, old_path: str = None
+):
+    return {
+        "props": {"file_name": fname, "change_type": change_type, "modify_in": date},
+        "old_path": old_path,
+        "features": features or [],
+    }
+
+
+def write_subgraph(
+    db: Neo4jDB,
+    subgraph: dict,
+    lineage: PathLineage = None,
+    canonical: dict = None,
+    merge_rels: bool = False,
+):
+    """
+    write the subgraph of a commit, one bulk statement per label / relationship type
+
+    a renamed file gets its own FileChange with a `RENAMED_FROM` edge to the
+    latest FileChange of the old path, looked up in `lineage`; a feature with
+    an entry in `canonical` gets an `INSTANCE_OF` edge to the CanonicalFeature
+    of that name; `merge_rels` makes relationship writes idempotent
+    """
+    lineage = PathLineage() if lineage is None else lineage
+    rels = defaultdict(list)
+    # create node and parents
+    commit_ids = db.merge_nodes_bulk(
+        "Commit",
+        None,
+        [subgraph["commit"]] + [{"name": p} for p in subgraph["parents"]],
+    )
+    commit_element_id = commit_ids[0]
+    for parent_element_id in commit_ids[1:]:
+        rels["PARENT_OF"].append(rel_row(parent_element_id, commit_element_id))
+        rels["CHILD_OF"].append(rel_row(commit_element_id, parent_element_id))
+    # create user
+    for user in subgraph["users"]:
+        user_node = db.merge_node(user["labels"], user["props"])
+        rels["COMMIT"].append(
+            rel_row(user_node["element_id"], commit_element_id, {"date": user["date"]})
+        )
+    date = subgraph["commit"]["committer_date"]
+
+    # create file changes, then their features
+    changes = subgraph["file_changes"]
+    feats = defaultdict(list)
+    instances = defaultdict(list)
+    fc_ids = db.merge_nodes_bulk("FileChange", None, [fc["props"] for fc in changes])
+    for fc, fcid in zip(changes, fc_ids):
+        change_type, fname = fc["props"]["change_type"], fc["props"]["file_name"]
+        rels[f"{change_type}_FILE"].append(
+            rel_row(commit_element_id, fcid, {"date": date})
+        )
+        if fc["old_path"]:
+            old_fcid = latest_file_change(db, lineage, fc["old_path"])
+            if old_fcid is None:
+                print(f"no file change found for {fc['old_path']}, renamed to {fname}")
+            else:
+                rels["RENAMED_FROM"].append(rel_row(fcid, old_fcid))
+            lineage.rename(fc["old_path"], fname, file_change_key(fc["props"]))
+        else:
+            lineage.record(fname, file_change_key(fc["props"]))
+        for kind, feat, ident in fc["features"]:
+            feats[kind].append(
+                {"name": feat, "ident": ident, f"{kind}_from": fname, f"{kind}_by": fcid}
             )
-        # create user
-        date = commit.committer_date
-        user_commit(
-            commit_element_id, commit.author, commit.committer, commit.author_date, date
+    for kind, feat_rows in feats.items():
+        feat_ids = db.merge_nodes_bulk("Feature", list(feat_rows[0]), feat_rows)
+        rels[FEAT_RELS[kind]].extend(
+            rel_row(row[f"{kind}_by"], feat_id)
+            for row, feat_id in zip(feat_rows, feat_ids)
         )
-        for file in commit.modified_files:
-            try:
-                match file.change_type:
-                    case ModificationType.ADD:
-                        fname = file.new_path
-                        if not fname in commit_knowledge:
-                            continue
-                        file_change_node = n4jdb.merge_node(
-                            "FileChange",
-                            {
-                                "file_name": fname,
-                                "change_type": "ADD",
-                                "modify_in": date,
-                            },
-                        )
-                        _ = n4jdb.create_relationship(
-                            commit_element_id,
-                            file_change_node["element_id"],
-                            "ADD_FILE",
-                            {"date": date},
-                        )
-                        file_add(file_change_node, fname, commit_knowledge[fname])
-                    case ModificationType.RENAME:
-                        fname, ofname = file.new_path, file.old_path
-                        ofile_change_node = n4jdb.match_nodes(
-                            "FileChange", {"file_name": ofname}, limit=1
-                        )[0]
-                        file_change_node = n4jdb.copy_node_and_relations(
-                            ofile_change_node["element_id"],
-                            {
-                                "file_name": fname,
-                                "change_type": "RENAME",
-                                "modify_in": date,
-                            },
-                        )
-                        _ = n4jdb.create_relationship(
-                            commit_element_id,
-                            file_change_node["element_id"],
-                            "RENAME_FILE",
-                            {"date": date},
-                        )
-                    case ModificationType.DELETE:
-                        fname = file.old_path
-                        if not fname in commit_knowledge:
-                            continue
-                        file_change_node = n4jdb.merge_node(
-                            "FileChange",
-                            {
-                                "file_name": fname,
-                                "change_type": "DELETE",
-                                "modify_in": date,
-                            },
-                        )
-                        _ = n4jdb.create_relationship(
-                            commit_element_id,
-                            file_change_node["element_id"],
-                            "DELETE_FILE",
-                            {"date": date},
-                        )
-                        file_del(file_change_node, fname, commit_knowledge[fname])
-                    case ModificationType.MODIFY:
-                        fname = file.old_path
-                        if not fname in commit_knowledge:
-                            continue
-                        file_change_node = n4jdb.merge_node(
-                            "FileChange",
-                            {
-                                "file_name": fname,
-                                "change_type": "MODIFY",
-                                "modify_in": date,
-                            },
-                        )
-                        _ = n4jdb.create_relationship(
-                            commit_element_id,
-                            file_change_node["element_id"],
-                            "MODIFY_FILE",
-                            {"date": date},
-                        )
-                        file_mod(file_change_node, fname, commit_knowledge[fname])
+        for row, feat_id in zip(feat_rows, feat_ids):
+            name = (canonical or {}).get(feature_key(row["name"], row["ident"]))
+            if name:
+                instances[name].append(feat_id)
+    if instances:
+        canonical_ids = db.merge_nodes_bulk(
+            "CanonicalFeature", None, [{"name": name} for name in instances]
+        )
+        for feat_ids, canonical_id in zip(instances.values(), canonical_ids):
+            rels["INSTANCE_OF"].extend(rel_row(f, canonical_id) for f in feat_ids)
 
-            except Exception as e:
-                print(e)
+    for rel_type, rows in rels.items():
+        db.create_relationships_bulk(rel_type, rows, merge=merge_rels)
 
         # if len(file.changed_methods) > 0:
         #     print(
@@ -134,123 +315,66 @@ def travese_commits(repo_path: str, knowledge: Dict[str, object], num_limit: int
         #     )
 
 
-def user_commit(
-    commit_element_id: str,
-    author: Developer,
-    committer: Developer,
-    author_date: datetime,
-    committer_date: datetime,
-):
-    if author != committer:
-        author_node = n4jdb.merge_node(
-            ["User", "Author"],
-            {"name": author.name, "email": author.email},
-        )
-        _ = n4jdb.create_relationship(
-            author_node["element_id"],
-            commit_element_id,
-            "COMMIT",
-            {"date": author_date},
-        )
-        committer_node = n4jdb.merge_node(
-            ["User", "Committer"],
-            {"name": committer.name, "email": committer.email},
-        )
-        _ = n4jdb.create_relationship(
-            committer_node["element_id"],
-            commit_element_id,
-            "COMMIT",
-            {"date": committer_date},
-        )
-    else:
-        committer_node = n4jdb.merge_node(
-            ["User", "Committer", "Author"],
-            {"name": committer.name, "email": committer.email},
-        )
-        _ = n4jdb.create_relationship(
-            committer_node["element_id"],
-            commit_element_id,
-            "COMMIT",
-            {"date": committer_date},
-        )
-
-
-def file_add(fc_node, fname, feat_dict: dict[str, object]):
-    if not isinstance(feat_dict, dict):
-        return
-    fcid = fc_node["element_id"]
-    for feat, ident in feat_dict.items():
-        if chk_no_in_str(feat):
-            continue
-        feat_node = n4jdb.merge_node(
-            "Feature", {"name": feat, "ident": ident, "add_from": fname, "add_by": fcid}
-        )
-        _ = n4jdb.create_relationship(fcid, feat_node["element_id"], "ADD_FEAT")
+def file_change_key(props: dict) -> dict:
+    """
+    MERGE key of a FileChange as kept in the lineage: element ids do not
+    survive a database wipe or a snapshot restore, key properties do
+    """
+    return {
+        "file_name": props["file_name"],
+        "change_type": props["change_type"],
+        "modify_in": props["modify_in"].isoformat(),
+    }
 
 
-def file_del(fc_node, fname, feat_dict: dict[str, object]):
-    if not isinstance(feat_dict, dict):
-        return
-    fcid = fc_node["element_id"]
-    for feat, ident in feat_dict.items():
-        if chk_no_in_str(feat):
-            continue
-        feat_node = n4jdb.merge_node(
-            "Feature", {"name": feat, "ident": ident, "delete_from": fname, "delete_by": fcid}
+def latest_file_change(db: Neo4jDB, lineage: PathLineage, file_path: str):
+    """
+    element id of the latest FileChange of `file_path`, resolved from its key
+    in `lineage`; from the database alone for paths ingested before the
+    lineage was kept or whose lineage entry is no longer in the database
+    """
+    key = lineage.get(file_path)
+    if key is not None:
+        nodes = db.match_nodes(
+            "FileChange", dict(key, modify_in=datetime.fromisoformat(key["modify_in"]))
         )
-        _ = n4jdb.create_relationship(fcid, feat_node["element_id"], "DELETE_FEAT")
-
-
-def file_mod(fc_node, fname, feat_dict: dict[str, dict]):
-    if "add" in feat_dict:
-        file_add(fc_node, fname, feat_dict["add"])
-    if "delete" in feat_dict:
-        file_del(fc_node, fname, feat_dict["delete"])
-    if "modify" in feat_dict:
-        if not isinstance(feat_dict["modify"], dict):
-            return
-        fcid = fc_node["element_id"]
-        for feat, ident in feat_dict["modify"].items():
-            if chk_no_in_str(feat):
-                continue
-            feat_node = n4jdb.merge_node(
-                "Feature",
-                {"name": feat, "ident": ident, "modify_from": fname, "modify_by": fcid},
-            )
-            _ = n4jdb.create_relationship(fcid, feat_node["element_id"], "MODIFY_FEAT")
+        if nodes:
+            return nodes[0]["element_id"]
+        print(f"lineage entry of {file_path} is not in the database, looking up by path")
+    nodes = db.match_nodes("FileChange", {"file_name": file_path})
+    if nodes:
+        return max(nodes, key=lambda n: n["properties"]["modify_in"])["element_id"]
+    return None
 
 
-def chk_no_in_str(s: str):
-    lowered = s[:min(8, len(s))].lower()
-    if lowered.find("no") != -1 and lowered[0].isalpha():
-        return True
-    return False
+def rel_row(from_id: str, to_id: str, properties: dict = None):
+    return {"from_id": from_id, "to_id": to_id, "properties": properties}
 
 
-def get_commit_properties(commit: Commit):
-    return {
-        "name": commit.hash,
-        "author_name": commit.author.name,  # nested properties not supported
-        "author_email": commit.author.email,
-        "author_date": commit.author_date,
-        "branches": list(commit.branches),
-        "committer_name": commit.committer.name,
-        "committer_email": commit.committer.email,
-        "committer_date": commit.committer_date,
-        "deletions": commit.deletions,
-        "files": commit.files,
-        "in_main_branch": commit.in_main_branch,
-        "insertions": commit.insertions,
-        "lines": commit.lines,
-        "merge": commit.merge,
-        "msg": commit.msg,
-        "parents": commit.parents,
-    }
+def user_commit(
+    author: dict,
+    committer: dict,
+    author_date: datetime,
+    committer_date: datetime,
+):
+    """`author` / `committer` are `{"name", "email"}` dicts"""
+    if author != committer:
+        return [
+            {"labels": ["User", "Author"], "props": author, "date": author_date},
+            {"labels": ["User", "Committer"], "props": committer, "date": committer_date},
+        ]
+    return [
+        {
+            "labels": ["User", "Committer", "Author"],
+            "props": committer,
+            "date": committer_date,
+        }
+    ]
 
 
-def load_json(fname_no_ext: str):
-    with open(fname_no_ext + ".json") as f:
-        return json.load(f)
+def load_json(fname_no_ext: str) -> KnowledgeIndex:
+    """the knowledge JSON as a lazy mapping, entries are decoded on lookup"""
+    return KnowledgeIndex.open(fname_no_ext)
 
 
 if __name__ == "__main__":
@@ -259,8 +383,52 @@ if __name__ == "__main__":
     WORK_DIR = path.dirname(__file__)
     chdir(WORK_DIR)
     REPO_PATH = path.join(WORK_DIR, path.pardir, "proj", REPO_NAME)
+    LINEAGE_FILE = JSON_NAME + ".lineage.json"
+    # INGEST_MODE=resume skips commits already in the graph, so re-runs and
+    # interrupted ingests only write what is missing
+    RESUME = getenv("INGEST_MODE") == "resume"
+    # Jaccard similarity at which features are consolidated, see feature_dedup.py
+    DEDUP_THRESHOLD = float(getenv("DEDUP_THRESHOLD", THRESHOLD))
     data = load_json(JSON_NAME)
-    travese_commits(REPO_PATH, knowledge=data)
+    n4jdb = open_db()
+    n4jdb.setup_schema()
+    # element ids of the in-process backend do not outlive the run
+    memory = isinstance(n4jdb, MemoryGraphDB)
+    lineage = PathLineage() if memory else PathLineage.load(LINEAGE_FILE)
+    # computed once per knowledge JSON and threshold, then read from its sidecar
+    canonical = canonical_for(JSON_NAME, data, DEDUP_THRESHOLD)
+    print(f"{len(canonical)} near-duplicate features, {len(set(canonical.values()))} canonical")
+    try:
+        if path.exists(JSON_NAME + ".meta.json"):
+            # no git access needed, see commit_meta.py
+            ingest(
+                n4jdb,
+                load_meta(JSON_NAME),
+                knowledge=skip_ingested(n4jdb, data) if RESUME else data,
+                lineage=lineage,
+                canonical=canonical,
+                merge_rels=RESUME,
+            )
+        else:
+            travese_commits(
+                n4jdb,
+                REPO_PATH,
+                knowledge=data,
+                lineage=lineage,
+                canonical=canonical,
+                resume=RESUME,
+            )
+        if getattr(n4jdb, "identity_cache", None):
+            cache = n4jdb.identity_cache
+            print(f"identity cache: {cache.hits} hits, {cache.misses} misses, {len(cache)} nodes")
+        if memory:
+            n4jdb.save(JSON_NAME + ".graph.pkl.gz")
+    finally:
+        # the lineage holds exactly the commits of the transactions committed so
+        # far, save it whether the run completed or not
+        if not memory:
+            lineage.save(LINEAGE_FILE)
+        n4jdb.close()
 
 
 # rename in 580b732e630c9eabb189fc63ac904a048b82902a 02d5167c4023dcc48c1c81499cbbcc1bf0615824 b1e7f9603f701bb97ae3a4a3fcbed47c887d074a
\ No newline at end of file
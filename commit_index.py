@@ -0,0 +1,122 @@
+"""usage: python commit_index.py <REPO_PATH> [COMMIT ...]
+
+Branch membership and line stats of every commit of a repository, computed
+with a few git processes instead of several per commit: reading
+`commit.branches` / `commit.in_main_branch` in pydriller runs
+`git branch --contains` for each commit, and `insertions` / `deletions` /
+`lines` / `files` a diff each.
+"""
+import subprocess
+from sys import argv
+
+
+def git_lines(repo_path: str, *args: str):
+    """stream the stdout lines of `git args` run in `repo_path`"""
+    with subprocess.Popen(
+        ["git", "-C", repo_path, *args],
+        stdout=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    ) as proc:
+        yield from proc.stdout
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, ["git", *args])
+
+
+class CommitIndex:
+    """
+    Per commit reachability from every local branch, one bit per branch in an
+    int, filled in one pass over `git rev-list --topo-order`: children come
+    before parents, so each commit ORs its bits into its parents'.
+
+    Line stats come from one `git log --numstat` stream, diffed against the
+    first parent like pydriller (via GitPython `Commit.stats`).
+    """
+
+    def __init__(self, repo_path: str, main_branch: str = None):
+        self.repo_path = repo_path
+        tips = [
+            line.split()
+            for line in git_lines(
+                repo_path, "for-each-ref", "--format=%(refname:short) %(objectname)", "refs/heads"
+            )
+        ]
+        self.branches = [branch for branch, _ in tips]
+        self.main_branch = main_branch or self._head_branch()
+        self.bits = {}
+        for i, (_, tip) in enumerate(tips):
+            self.bits[tip] = self.bits.get(tip, 0) | 1 << i
+        self.stats = {}
+        self._index_branches()
+        self._index_stats()
+
+    def _head_branch(self):
+        try:
+            return next(git_lines(self.repo_path, "symbolic-ref", "--short", "HEAD")).strip()
+        except (subprocess.CalledProcessError, StopIteration):  # detached HEAD
+            return None
+
+    def _index_branches(self):
+        for line in git_lines(self.repo_path, "rev-list", "--topo-order", "--parents", "--branches"):
+            commit, *parents = line.split()
+            bits = self.bits.setdefault(commit, 0)
+            for parent in parents:
+                self.bits[parent] = self.bits.get(parent, 0) | bits
+
+    def _index_stats(self):
+        stats = None
+        for line in git_lines(
+            self.repo_path,
+            "log",
+            "--branches",
+            "--numstat",
+            "--no-renames",
+            "--diff-merges=first-parent",
+            "--format=%x00%H",
+        ):
+            if line.startswith("\x00"):
+                stats = self.stats[line[1:].strip()] = {
+                    "insertions": 0,
+                    "deletions": 0,
+                    "lines": 0,
+                    "files": 0,
+                }
+                continue
+            parts = line.rstrip("\n").split("\t", 2)
+            if stats is None or len(parts) != 3:
+                continue
+            # binary files are listed as "-\t-"
+            added = int(parts[0]) if parts[0].isdigit() else 0
+            deleted = int(parts[1]) if parts[1].isdigit() else 0
+            stats["insertions"] += added
+            stats["deletions"] += deleted
+            stats["lines"] += added + deleted
+            stats["files"] += 1
+
+    def __contains__(self, commit_hash: str):
+        return commit_hash in self.stats
+
+    def branches_of(self, commit_hash: str) -> list[str]:
+        bits = self.bits.get(commit_hash, 0)
+        return [branch for i, branch in enumerate(self.branches) if bits >> i & 1]
+
+    def in_main_branch(self, commit_hash: str) -> bool:
+        if self.main_branch not in self.branches:
+            return False
+        return bool(self.bits.get(commit_hash, 0) >> self.branches.index(self.main_branch) & 1)
+
+    def properties(self, commit_hash: str) -> dict:
+        """the branch and stats properties of `get_commit_properties`"""
+        return dict(
+            self.stats[commit_hash],
+            branches=self.branches_of(commit_hash),
+            in_main_branch=self.in_main_branch(commit_hash),
+        )
+
+
+if __name__ == "__main__":
+    index = CommitIndex(argv[1])
+    print(f"{len(index.stats)} commits, branches: {index.branches}, main: {index.main_branch}")
+    for commit_hash in argv[2:]:
+        print(commit_hash, index.properties(commit_hash))
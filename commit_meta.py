@@ -0,0 +1,116 @@
+"""usage: python commit_meta.py <REPO_PATH> <JSON_NAME>
+
+Metadata sidecar `<JSON_NAME>.meta.json` next to the analysis `<JSON_NAME>.json`
+written by `commits.py`: for every analysed commit, in traversal order, the
+commit properties and the change type / paths of its modified files. With the
+pair `commit2graph.py` and `graph_import.py` build the graph without git.
+
+Run this module to write the sidecar of an analysis made before sidecars existed.
+"""
+import json
+from datetime import datetime
+from sys import argv
+from typing import Iterable
+
+from pydriller import Repository
+from pydriller.domain.commit import Commit
+
+from commit_index import CommitIndex
+
+META_VERSION = 1
+# commit properties stored as ISO 8601 strings in the sidecar
+DATE_PROPS = ("author_date", "committer_date")
+
+
+def commit_record(commit: Commit, index: CommitIndex = None):
+    """plain description of `commit`, the only part of the ingestion that reads git"""
+    return {
+        "commit": get_commit_properties(commit, index),
+        "modified_files": [
+            {
+                "change_type": file.change_type.name,
+                "old_path": file.old_path,
+                "new_path": file.new_path,
+            }
+            for file in commit.modified_files
+        ],
+    }
+
+
+def get_commit_properties(commit: Commit, index: CommitIndex = None):
+    """branches and line stats are read from `index` when given, see commit_index.py"""
+    if index is not None and commit.hash in index:
+        precomputed = index.properties(commit.hash)
+    else:
+        precomputed = {
+            "branches": list(commit.branches),
+            "deletions": commit.deletions,
+            "files": commit.files,
+            "in_main_branch": commit.in_main_branch,
+            "insertions": commit.insertions,
+            "lines": commit.lines,
+        }
+    return {
+        "name": commit.hash,
+        "author_name": commit.author.name,  # nested properties not supported
+        "author_email": commit.author.email,
+        "author_date": commit.author_date,
+        "branches": precomputed["branches"],
+        "committer_name": commit.committer.name,
+        "committer_email": commit.committer.email,
+        "committer_date": commit.committer_date,
+        "deletions": precomputed["deletions"],
+        "files": precomputed["files"],
+        "in_main_branch": precomputed["in_main_branch"],
+        "insertions": precomputed["insertions"],
+        "lines": precomputed["lines"],
+        "merge": commit.merge,
+        "msg": commit.msg,
+        "parents": commit.parents,
+    }
+
+
+def save_meta(file_name_no_ext: str, records: Iterable[dict]):
+    records = [
+        dict(
+            record,
+            commit=dict(
+                record["commit"],
+                **{k: record["commit"][k].isoformat() for k in DATE_PROPS},
+            ),
+        )
+        for record in records
+    ]
+    print(f"saving {len(records)} commit records > {file_name_no_ext}.meta.json")
+    with open(file_name_no_ext + ".meta.json", "w") as fp:
+        json.dump({"version": META_VERSION, "commits": records}, fp, separators=(",", ":"))
+
+
+def load_meta(file_name_no_ext: str) -> list[dict]:
+    """commit records of the sidecar, in traversal order"""
+    with open(file_name_no_ext + ".meta.json") as fp:
+        meta = json.load(fp)
+    if meta.get("version") != META_VERSION:
+        raise ValueError(
+            f"{file_name_no_ext}.meta.json: unsupported version {meta.get('version')}"
+        )
+    for record in meta["commits"]:
+        commit = record["commit"]
+        for k in DATE_PROPS:
+            commit[k] = datetime.fromisoformat(commit[k])
+    return meta["commits"]
+
+
+if __name__ == "__main__":
+    REPO_PATH, JSON_NAME = argv[1], argv[2]
+    with open(JSON_NAME + ".json") as f:
+        knowledge = json.load(f)
+    index = CommitIndex(REPO_PATH)
+    save_meta(
+        JSON_NAME,
+        (
+            commit_record(commit, index)
+            for commit in Repository(REPO_PATH).traverse_commits()
+            if commit.hash in knowledge
+        ),
+    )
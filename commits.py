@@ -9,6 +9,9 @@ from markdown_to_json import dictify
 
 # from static_analysis.dump import dump
 from api_agicto import request_llm
+from commit_index import CommitIndex
+from commit_meta import commit_record, save_meta
+from knowledge_index import build_index
 
 
 K = 4096
@@ -99,9 +102,12 @@ def travese_commits(
     max_retries: int = 4,
     time_sleep: float = 2,
     single: str = None,
+    meta: list = None,
 ):
+    """`meta`, if given, receives the commit record of every visited commit, see commit_meta.py"""
     cnt = 0
     ans = {}
+    index = CommitIndex(repo_path) if meta is not None else None
     for commit in Repository(repo_path, single=single).traverse_commits():
         if cnt == num_limit:
             break
@@ -149,6 +155,8 @@ def travese_commits(
 
         mod_files_resp["summary"] = summary
         ans[commit.hash] = mod_files_resp
+        if meta is not None:
+            meta.append(commit_record(commit, index))
 
         # if len(file.changed_methods) > 0:
         #     print(
@@ -288,18 +296,20 @@ if __name__ == "__main__":
     chdir(WORK_DIR)
     # REPO_PATH = path.join(WORK_DIR, path.pardir, "proj", REPO_NAME)
     REPO_PATH = path.join("path_to_repo", REPO_NAME)
-    ans = travese_commits(REPO_PATH, max_retries=8)
-    save_to_json(
-        "_".join(
-            [
-                REPO_NAME,
-                MODEL,
-                STRONG_MODEL if MODEL != STRONG_MODEL else "",
-                str(int(time())),
-            ]
-        ),
-        ans,
+    meta = []
+    ans = travese_commits(REPO_PATH, max_retries=8, meta=meta)
+    JSON_NAME = "_".join(
+        [
+            REPO_NAME,
+            MODEL,
+            STRONG_MODEL if MODEL != STRONG_MODEL else "",
+            str(int(time())),
+        ]
     )
+    save_to_json(JSON_NAME, ans)
+    save_meta(JSON_NAME, meta)
+    if ans:
+        build_index(JSON_NAME)
 
 
 # PS_CODE = "ps: comments and doc strings are helpful to understand code; DO NOT explain, answer directly; "
@@ -1,5 +1,155 @@
-from typing import Union, List, Dict, Optional
-from neo4j import GraphDatabase, Transaction, Result
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import local, Lock
+from typing import Callable, Union, List, Dict, Optional
+from neo4j import GraphDatabase, Transaction, Result, READ_ACCESS, WRITE_ACCESS
+from neo4j.exceptions import Neo4jError
+from neo4j.graph import Node, Relationship
+
+from graph_snapshot import restore_snapshot, write_snapshot
+
+# MERGE 时用于匹配的键属性（按标签），其余属性通过 SET 写入
+MERGE_KEYS = {
+    "Commit": ["name"],
+    "User": ["name", "email"],
+    "FileChange": ["file_name", "change_type", "modify_in"],
+    "CanonicalFeature": ["name"],
+    "Issue": ["repo", "number"],
+    "FileMonth": ["file_name", "month"],
+    "FileStats": ["file_name"],
+    "AuthorFeature": ["email", "feature"],
+}
+
+# 键属性对应的约束和索引，CREATE ... IF NOT EXISTS 可重复执行
+SCHEMA = [
+    "CREATE CONSTRAINT commit_name IF NOT EXISTS "
+    "FOR (n:Commit) REQUIRE n.name IS UNIQUE",
+    "CREATE CONSTRAINT user_name_email IF NOT EXISTS "
+    "FOR (n:User) REQUIRE (n.name, n.email) IS UNIQUE",
+    "CREATE INDEX user_email IF NOT EXISTS FOR (n:User) ON (n.email)",
+    "CREATE INDEX file_change_key IF NOT EXISTS "
+    "FOR (n:FileChange) ON (n.file_name, n.change_type, n.modify_in)",
+    "CREATE INDEX file_change_file_name IF NOT EXISTS "
+    "FOR (n:FileChange) ON (n.file_name)",
+    "CREATE CONSTRAINT canonical_feature_name IF NOT EXISTS "
+    "FOR (n:CanonicalFeature) REQUIRE n.name IS UNIQUE",
+    "CREATE CONSTRAINT issue_repo_number IF NOT EXISTS "
+    "FOR (n:Issue) REQUIRE (n.repo, n.number) IS UNIQUE",
+    "CREATE CONSTRAINT file_month_key IF NOT EXISTS "
+    "FOR (n:FileMonth) REQUIRE (n.file_name, n.month) IS UNIQUE",
+    "CREATE CONSTRAINT file_stats_file_name IF NOT EXISTS "
+    "FOR (n:FileStats) REQUIRE n.file_name IS UNIQUE",
+    "CREATE INDEX file_stats_changes IF NOT EXISTS FOR (n:FileStats) ON (n.changes)",
+    "CREATE CONSTRAINT author_feature_key IF NOT EXISTS "
+    "FOR (n:AuthorFeature) REQUIRE (n.email, n.feature) IS UNIQUE",
+    "CREATE INDEX feature_name IF NOT EXISTS FOR (n:Feature) ON (n.name)",
+    "CREATE TEXT INDEX feature_name_text IF NOT EXISTS FOR (n:Feature) ON (n.name)",
+]
+
+
+def merge_key(
+    labels: List[str], key_props: Optional[List[str]], properties: dict
+) -> tuple[List[str], List[str], List[str]]:
+    """
+    确定 MERGE 使用的标签和键属性
+
+    以第一个在 MERGE_KEYS 中配置过的标签匹配（可命中唯一约束和索引），其余标签通过 SET 添加；
+    均未配置时使用全部标签，键属性默认取 MERGE_KEYS，仍为空时使用全部属性
+
+    :return: (MERGE 标签, 键属性, 额外标签)
+    """
+    merge_labels, extra_labels = labels, []
+    for label in labels:
+        if label in MERGE_KEYS:
+            merge_labels = [label]
+            extra_labels = [l for l in labels if l != label]
+            key_props = key_props or MERGE_KEYS[label]
+            break
+    return merge_labels, key_props or list(properties), extra_labels
+
+
+class IdentityCache:
+    """
+    客户端身份映射：(MERGE 标签, 键属性值) -> 已合并节点，按 LRU 淘汰
+
+    只缓存本进程写入或读到的结果，其他进程对同一节点的删除不可见，
+    因此只适合由单个导入进程独占写入的场景
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._nodes = OrderedDict()
+        self._keys = {}  # element_id -> key，用于按节点失效
+        self._lock = Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(labels: List[str], key_props: Optional[List[str]], properties: dict):
+        """缓存键，键属性值不可哈希时返回 None（不缓存）"""
+        merge_labels, key_props, _ = merge_key(labels, key_props, properties)
+        key = (tuple(merge_labels), tuple((k, properties.get(k)) for k in key_props))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key, labels: List[str], properties: dict) -> Optional[dict]:
+        """命中且缓存的标签、属性包含本次写入的全部标签、属性时返回节点，否则返回 None"""
+        with self._lock:
+            node = self._nodes.get(key)
+            if node is None or not self.contains(node, labels, properties):
+                self.misses += 1
+                return None
+            self._nodes.move_to_end(key)
+            self.hits += 1
+            return node
+
+    def peek(self, key) -> Optional[dict]:
+        """不计入命中统计、不更新 LRU 顺序"""
+        with self._lock:
+            return self._nodes.get(key)
+
+    @staticmethod
+    def contains(node: dict, labels: List[str], properties: dict) -> bool:
+        return set(labels) <= set(node["labels"]) and all(
+            k in node["properties"] and node["properties"][k] == v
+            for k, v in properties.items()
+        )
+
+    def put(self, key, node: dict):
+        with self._lock:
+            old = self._nodes.pop(key, None)
+            if old is not None:
+                self._keys.pop(old["element_id"], None)
+            self._nodes[key] = node
+            self._keys[node["element_id"]] = key
+            while len(self._nodes) > self.maxsize:
+                _, evicted = self._nodes.popitem(last=False)
+                self._keys.pop(evicted["element_id"], None)
+
+    def discard(self, element_id: str):
+        with self._lock:
+            key = self._keys.pop(element_id, None)
+            if key is not None:
+                del self._nodes[key]
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+# 复制节点时读取节点及其全部出向、入向关系
+COPY_READ_QUERY = (
+    "MATCH (n) WHERE elementId(n) = $element_id "
+    "RETURN n, "
+    "[(n)-[r]->(m) | {type: type(r), props: properties(r), other: elementId(m)}] AS out_rels, "
+    "[(m)-[r]->(n) | {type: type(r), props: properties(r), other: elementId(m)}] AS in_rels"
+)
 
 
 class Neo4jDB:
@@ -9,14 +159,45 @@ class Neo4jDB:
         user: str = "neo4j",
         password: str = "12345678",
         database: str = None,
+        batch_size: int = 1000,
+        identity_cache_size: int = 0,
     ):
         """
         :param database: 数据库名称（可选，社区版不需要）
+        :param batch_size: 批量写入时每条语句的行数
+        :param identity_cache_size: 大于 0 时启用 IdentityCache，重复合并同一节点时不再访问服务器
         """
         self._driver = GraphDatabase.driver(uri, auth=(user, password))
         self._database = database
-        self._session = None
-        self._transaction = None
+        self.batch_size = batch_size
+        self.identity_cache = (
+            IdentityCache(identity_cache_size) if identity_cache_size > 0 else None
+        )
+        # 当前线程正在使用的会话和事务，存在时所有操作都通过该事务执行
+        self._local = local()
+
+    @property
+    def _session(self):
+        return getattr(self._local, "session", None)
+
+    @_session.setter
+    def _session(self, session):
+        self._local.session = session
+
+    @property
+    def _pending(self) -> dict:
+        """当前事务中合并的节点，提交后才写入 identity_cache，回滚或重试时丢弃"""
+        if not hasattr(self._local, "pending"):
+            self._local.pending = {}
+        return self._local.pending
+
+    @property
+    def _transaction(self):
+        return getattr(self._local, "transaction", None)
+
+    @_transaction.setter
+    def _transaction(self, transaction):
+        self._local.transaction = transaction
 
     def close(self):
         self._driver.close()
@@ -30,9 +211,39 @@ class Neo4jDB:
         :return: 查询结果
         """
         parameters = parameters or {}
+        if self._transaction:
+            return list(self._transaction.run(query, parameters, **kwargs))
         with self._driver.session(database=self._database) as session:
-            result = session.run(query, parameters, **kwargs)
-            return [result.single()]
+            return list(session.run(query, parameters, **kwargs))
+
+    def stream_query(
+        self,
+        query: str,
+        parameters: dict = None,
+        fetch_size: int = 1000,
+        read: bool = True,
+    ):
+        """
+        惰性逐条读取查询结果，内存占用与结果总量无关
+
+        :param query: Cypher查询语句
+        :param parameters: 查询参数字典
+        :param fetch_size: 每次从服务器拉取的记录数
+        :param read: 路由到读节点（集群中由从节点处理）
+        :return: 记录字典的生成器，其中的节点和关系已转换为字典
+        """
+        parameters = parameters or {}
+        if self._transaction:
+            for record in self._transaction.run(query, parameters):
+                yield self._convert_record(record)
+            return
+        with self._driver.session(
+            database=self._database,
+            fetch_size=fetch_size,
+            default_access_mode=READ_ACCESS if read else WRITE_ACCESS,
+        ) as session:
+            for record in session.run(query, parameters):
+                yield self._convert_record(record)
 
     def create_node(
         self, labels: Union[str, List[str]], properties: dict = None
@@ -44,30 +255,250 @@ class Neo4jDB:
         :param properties: 节点属性字典
         :return: 创建的节点信息
         """
-        if isinstance(labels, str):
-            labels = [labels]
-        label_str = ":".join(labels)
-        query = f"CREATE (n:{label_str} $props) RETURN n"
+        query = self._create_node_query(labels)
         result = self.execute_query(query, {"props": properties or {}})
         new_node = result[0]["n"]
         return self._convert_node(new_node)
 
-    def merge_node(self, labels: Union[str, List[str]], properties: dict = None):
+    @staticmethod
+    def _create_node_query(labels: Union[str, List[str]]) -> str:
+        if isinstance(labels, str):
+            labels = [labels]
+        label_str = ":".join(labels)
+        return f"CREATE (n:{label_str} $props) RETURN n"
+
+    def setup_schema(self, schema: List[str] = SCHEMA):
+        """
+        创建 MERGE 键属性的唯一约束和索引（幂等），建议在导入前执行一次
+
+        已有重复数据时约束无法创建，只打印错误，不影响其余语句
         """
-        合并节点
+        for statement in schema:
+            try:
+                with self._driver.session(database=self._database) as session:
+                    session.run(statement).consume()
+            except Neo4jError as e:
+                print(f"schema setup failed: {statement}\n{e}")
+        with self._driver.session(database=self._database) as session:
+            session.run("CALL db.awaitIndexes(300)").consume()
+
+    def merge_node(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        key_props: List[str] = None,
+    ):
+        """
+        合并节点：只按键属性 MERGE，其余属性通过 SET 写入
 
         :param label: 节点标签
         :param properties: 节点属性字典
+        :param key_props: MERGE 匹配使用的属性名，默认见 MERGE_KEYS，未配置的标签使用全部属性
         :return: 创建的节点信息
         """
         if isinstance(labels, str):
             labels = [labels]
-        label_str = ":".join(labels)
-        prop_placeholders = ", ".join([f"{k}: ${k}" for k in properties.keys()])
-        cypher = f"MERGE (n:{label_str} {{{prop_placeholders}}}) RETURN n"
-        result = self.execute_query(cypher, properties)
-        merged_node = result[0]["n"]
-        return self._convert_node(merged_node)
+        properties = properties or {}
+        key = self._cache_key(labels, key_props, properties)
+        cached = self._cache_get(key, labels, properties)
+        if cached:
+            return cached
+        cypher = self._merge_query(labels, key_props, "$props", properties) + " RETURN n"
+        result = self.execute_query(cypher, {"props": properties})
+        merged_node = self._convert_node(result[0]["n"])
+        self._cache_put(key, merged_node)
+        return merged_node
+
+    def merge_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: Optional[List[str]],
+        rows: List[dict],
+        batch_size: int = None,
+    ) -> List[str]:
+        """
+        批量合并节点，每条语句通过 UNWIND 写入 batch_size 行
+
+        :param labels: 节点标签
+        :param key_props: MERGE 匹配使用的属性名，其余属性通过 SET 写入，为 None 时同 merge_node
+        :param rows: 节点属性字典列表
+        :param batch_size: 每条语句的行数，默认使用 self.batch_size
+        :return: 按输入顺序排列的节点ID
+        """
+        if isinstance(labels, str):
+            labels = [labels]
+        if not rows:
+            return []
+        element_ids = [None] * len(rows)
+        keys = [self._cache_key(labels, key_props, row) for row in rows]
+        missed = []
+        for i, (key, row) in enumerate(zip(keys, rows)):
+            cached = self._cache_get(key, labels, row)
+            if cached:
+                element_ids[i] = cached["element_id"]
+            else:
+                missed.append(i)
+        if not missed:
+            return element_ids
+        query = self._merge_nodes_bulk_query(labels, key_props, rows[0])
+        merged_ids = self._write_batches(
+            query, [{"props": rows[i]} for i in missed], batch_size
+        )
+        for i, element_id in zip(missed, merged_ids):
+            element_ids[i] = element_id
+            self._cache_put(
+                keys[i],
+                {"element_id": element_id, "labels": labels, "properties": rows[i]},
+            )
+        return element_ids
+
+    def _cache_key(self, labels: List[str], key_props: Optional[List[str]], properties: dict):
+        if self.identity_cache is None:
+            return None
+        return IdentityCache.key(labels, key_props, properties)
+
+    def _cache_get(self, key, labels: List[str], properties: dict) -> Optional[dict]:
+        """先查当前事务中合并的节点，再查 identity_cache，返回节点的副本"""
+        if key is None:
+            return None
+        node = self._pending.get(key) if self._transaction else None
+        if node is None:
+            node = self.identity_cache.get(key, labels, properties)
+        elif not IdentityCache.contains(node, labels, properties):
+            node = None
+        if node is None:
+            return None
+        return dict(node, labels=list(node["labels"]), properties=dict(node["properties"]))
+
+    def _cache_put(self, key, node: dict):
+        """SET n += props 之后节点属性是旧属性与本次属性的并集，已知的旧属性一并保留"""
+        if key is None:
+            return
+        old = self._pending.get(key) if self._transaction else None
+        old = old or self.identity_cache.peek(key)
+        if old and old["element_id"] == node["element_id"]:
+            node = {
+                "element_id": node["element_id"],
+                "labels": sorted(set(old["labels"]) | set(node["labels"])),
+                "properties": dict(old["properties"], **node["properties"]),
+            }
+        if self._transaction:
+            self._pending[key] = node
+        else:
+            self.identity_cache.put(key, node)
+
+    def _cache_discard(self, element_id: str):
+        if self.identity_cache is None:
+            return
+        self.identity_cache.discard(element_id)
+        for key, node in list(self._pending.items()):
+            if node["element_id"] == element_id:
+                del self._pending[key]
+
+    def _flush_pending(self, committed: bool):
+        """事务结束：提交时将事务中合并的节点写入 identity_cache，否则丢弃"""
+        pending, self._local.pending = self._pending, {}
+        if committed and self.identity_cache is not None:
+            for key, node in pending.items():
+                self.identity_cache.put(key, node)
+
+    @classmethod
+    def _merge_nodes_bulk_query(
+        cls, labels: Union[str, List[str]], key_props: Optional[List[str]], first_row: dict
+    ) -> str:
+        if isinstance(labels, str):
+            labels = [labels]
+        return (
+            "UNWIND $rows AS row "
+            + cls._merge_query(labels, key_props, "row.props", first_row)
+            + " RETURN row.i AS i, elementId(n) AS element_id"
+        )
+
+    @staticmethod
+    def _merge_query(
+        labels: List[str], key_props: Optional[List[str]], props: str, properties: dict
+    ) -> str:
+        """构建按键属性 MERGE 的 Cypher 片段，见 merge_key"""
+        merge_labels, key_props, extra_labels = merge_key(labels, key_props, properties)
+        key_str = ", ".join([f"{k}: {props}.{k}" for k in key_props])
+        query = f"MERGE (n:{':'.join(merge_labels)} {{{key_str}}})"
+        if extra_labels:
+            query += f" SET n:{':'.join(extra_labels)}"
+        return query + f" SET n += {props}"
+
+    def increment_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: List[str],
+        rows: List[dict],
+        max_props: List[str] = None,
+        batch_size: int = None,
+    ) -> List[str]:
+        """
+        批量累加计数节点：按 key_props MERGE，其余属性累加到已有值上（不存在时视为 0），
+        max_props 中的属性取新旧值中的较大者；所有行的属性名应与第一行相同
+
+        :return: 按输入顺序排列的节点ID
+        """
+        if not rows:
+            return []
+        query = self._increment_nodes_bulk_query(labels, key_props, rows[0], max_props)
+        return self._write_batches(
+            query, [{"props": row} for row in rows], batch_size
+        )
+
+    @staticmethod
+    def _increment_nodes_bulk_query(
+        labels: Union[str, List[str]],
+        key_props: List[str],
+        first_row: dict,
+        max_props: List[str] = None,
+    ) -> str:
+        if isinstance(labels, str):
+            labels = [labels]
+        max_props = max_props or []
+        merge_labels, key_props, extra_labels = merge_key(labels, key_props, first_row)
+        key_str = ", ".join([f"{k}: row.props.{k}" for k in key_props])
+        sets = [
+            f"n.{k} = CASE WHEN n.{k} IS NULL OR row.props.{k} > n.{k} "
+            f"THEN row.props.{k} ELSE n.{k} END"
+            if k in max_props
+            else f"n.{k} = coalesce(n.{k}, 0) + row.props.{k}"
+            for k in first_row
+            if k not in key_props
+        ]
+        query = f"UNWIND $rows AS row MERGE (n:{':'.join(merge_labels)} {{{key_str}}})"
+        if extra_labels:
+            query += f" SET n:{':'.join(extra_labels)}"
+        if sets:
+            query += " SET " + ", ".join(sets)
+        return query + " RETURN row.i AS i, elementId(n) AS element_id"
+
+    def create_nodes_bulk(
+        self, labels: Union[str, List[str]], rows: List[dict], batch_size: int = None
+    ) -> List[str]:
+        """
+        批量创建节点，每条语句通过 UNWIND 写入 batch_size 行
+
+        :param labels: 节点标签
+        :param rows: 节点属性字典列表
+        :param batch_size: 每条语句的行数，默认使用 self.batch_size
+        :return: 按输入顺序排列的节点ID
+        """
+        query = self._create_nodes_bulk_query(labels)
+        return self._write_batches(
+            query, [{"props": row} for row in rows], batch_size
+        )
+
+    @staticmethod
+    def _create_nodes_bulk_query(labels: Union[str, List[str]]) -> str:
+        if isinstance(labels, str):
+            labels = [labels]
+        return (
+            "UNWIND $rows AS row "
+            f"CREATE (n:{':'.join(labels)}) SET n = row.props "
+            "RETURN row.i AS i, elementId(n) AS element_id"
+        )
 
     def match_nodes(
         self, labels: Union[str, List[str]], properties: dict = None, limit: int = None
@@ -79,6 +510,58 @@ class Neo4jDB:
         :param properties: 匹配属性字典
         :return: 匹配节点列表
         """
+        return list(self.iter_nodes(labels, properties, limit))
+
+    def iter_nodes(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        """
+        流式查找匹配条件的节点
+
+        :param label: 节点标签
+        :param properties: 匹配属性字典
+        :param fetch_size: 每次从服务器拉取的记录数
+        :return: 匹配节点的生成器
+        """
+        query = self._match_nodes_query(labels, properties, limit)
+        for record in self.stream_query(query, properties, fetch_size):
+            yield record["n"]
+
+    def existing_keys(
+        self, label: str, key_prop: str, required_prop: str = None, values: list = None
+    ) -> set:
+        """
+        用一条查询取出某标签全部节点的键属性值
+
+        :param label: 节点标签
+        :param key_prop: 键属性
+        :param required_prop: 只统计具有该属性的节点，用于排除仅作为占位合并的节点
+        :param values: 只检查这些键值（走键属性索引），默认取出全部
+        :return: 键属性值集合
+        """
+        query = self._existing_keys_query(label, key_prop, required_prop, values is not None)
+        return {record["key"] for record in self.stream_query(query, {"values": values})}
+
+    @staticmethod
+    def _existing_keys_query(
+        label: str, key_prop: str, required_prop: str = None, in_values: bool = False
+    ) -> str:
+        conditions = []
+        if in_values:
+            conditions.append(f"n.{key_prop} IN $values")
+        if required_prop:
+            conditions.append(f"n.{required_prop} IS NOT NULL")
+        where_clause = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return f"MATCH (n:{label}) {where_clause}RETURN n.{key_prop} AS key"
+
+    @staticmethod
+    def _match_nodes_query(
+        labels: Union[str, List[str]], properties: dict = None, limit: int = None
+    ) -> str:
         if isinstance(labels, str):
             labels = [labels]
         label_str = ":".join(labels)
@@ -88,9 +571,7 @@ class Neo4jDB:
             else ""
         )
         limit_clause = f"LIMIT {limit}" if limit else ""
-        query = f"MATCH (n:{label_str}) {where_clause} RETURN n {limit_clause}"
-        result = self.execute_query(query, parameters=properties or {})
-        return [self._convert_node(record["n"]) for record in result]
+        return f"MATCH (n:{label_str}) {where_clause} RETURN n {limit_clause}"
 
     def create_relationship(
         self, from_id: str, to_id: str, rel_type: str, properties: dict = None
@@ -104,15 +585,86 @@ class Neo4jDB:
         :param properties: 关系属性
         :return: 创建的关系信息
         """
-        query = (
+        query = self._create_relationship_query(rel_type)
+        result = self.execute_query(
+            query, {"from_id": from_id, "to_id": to_id, "props": properties or {}}
+        )
+        return self._convert_relationship(result[0]["r"])
+
+    @staticmethod
+    def _create_relationship_query(rel_type: str) -> str:
+        return (
             "MATCH (a), (b) "
             "WHERE elementId(a) = $from_id AND elementId(b) = $to_id "
             f"CREATE (a)-[r:{rel_type} $props]->(b) RETURN r"
         )
-        result = self.execute_query(
-            query, {"from_id": from_id, "to_id": to_id, "props": properties or {}}
+
+    def create_relationships_bulk(
+        self, rel_type: str, rows: List[dict], batch_size: int = None, merge: bool = False
+    ) -> List[Optional[str]]:
+        """
+        批量创建关系，每条语句通过 UNWIND 写入 batch_size 行
+
+        :param rel_type: 关系类型
+        :param rows: 关系字典列表，包含 from_id、to_id 以及可选的 properties
+        :param batch_size: 每条语句的行数，默认使用 self.batch_size
+        :param merge: 使用 MERGE，两点之间已有同类型关系时只更新其属性，重复写入不产生重复关系
+        :return: 按输入顺序排列的关系ID，端点不存在时为 None
+        """
+        query = self._create_relationships_bulk_query(rel_type, merge)
+        return self._write_batches(query, self._relationship_rows(rows), batch_size)
+
+    @staticmethod
+    def _create_relationships_bulk_query(rel_type: str, merge: bool = False) -> str:
+        return (
+            "UNWIND $rows AS row "
+            "MATCH (a) WHERE elementId(a) = row.from_id "
+            "MATCH (b) WHERE elementId(b) = row.to_id "
+            f"{'MERGE' if merge else 'CREATE'} (a)-[r:{rel_type}]->(b) SET r = row.props "
+            "RETURN row.i AS i, elementId(r) AS element_id"
         )
-        return self._convert_relationship(result[0]["r"])
+
+    @staticmethod
+    def _relationship_rows(rows: List[dict]) -> List[dict]:
+        return [
+            {
+                "from_id": row["from_id"],
+                "to_id": row["to_id"],
+                "props": row.get("properties") or {},
+            }
+            for row in rows
+        ]
+
+    def _write_batches(
+        self, query: str, rows: List[dict], batch_size: int = None
+    ) -> List[Optional[str]]:
+        """分批执行 UNWIND 写入语句，按 row.i 还原输入顺序"""
+        batch_size = batch_size or self.batch_size
+        element_ids = [None] * len(rows)
+        if not rows:
+            return element_ids
+
+        def write(tx, batch):
+            return [(r["i"], r["element_id"]) for r in tx.run(query, rows=batch)]
+
+        batches = self._batches(rows, batch_size)
+        if self._transaction:
+            results = [write(self._transaction, batch) for batch in batches]
+        else:
+            with self._driver.session(database=self._database) as session:
+                results = [session.execute_write(write, batch) for batch in batches]
+        for result in results:
+            for i, element_id in result:
+                element_ids[i] = element_id
+        return element_ids
+
+    @staticmethod
+    def _batches(rows: List[dict], batch_size: int) -> List[List[dict]]:
+        """按 batch_size 切分，每行附加输入序号 i"""
+        return [
+            [dict(row, i=start + i) for i, row in enumerate(rows[start : start + batch_size])]
+            for start in range(0, len(rows), batch_size)
+        ]
 
     def find_relationships(
         self,
@@ -132,9 +684,47 @@ class Neo4jDB:
         :param limit: 返回结果数量限制
         :return: 匹配关系列表
         """
+        return list(
+            self.iter_relationships(from_labels, to_labels, rel_type, properties, limit)
+        )
+
+    def iter_relationships(
+        self,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        """
+        流式查找匹配条件的关系，参数同 find_relationships
+
+        :param fetch_size: 每次从服务器拉取的记录数
+        :return: 匹配关系的生成器
+        """
+        query = self._find_relationships_query(
+            from_labels, to_labels, rel_type, properties, limit
+        )
+        for record in self.stream_query(query, properties, fetch_size):
+            yield {
+                "relationship": record["r"],
+                "from_node": record["a"],
+                "to_node": record["b"],
+            }
+
+    @classmethod
+    def _find_relationships_query(
+        cls,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+    ) -> str:
         # 构建标签匹配部分
-        from_label_str = self._build_label_match("a", from_labels)
-        to_label_str = self._build_label_match("b", to_labels)
+        from_label_str = cls._build_label_match("a", from_labels)
+        to_label_str = cls._build_label_match("b", to_labels)
         rel_type_str = f":{rel_type}" if rel_type else ""
 
         # 构建WHERE条件
@@ -145,24 +735,13 @@ class Neo4jDB:
 
         limit_clause = f"LIMIT {limit}" if limit else ""
 
-        query = (
+        return (
             f"MATCH (a{from_label_str})-[r{rel_type_str}]->(b{to_label_str}) "
             f"{where_clause} RETURN r, a, b {limit_clause}"
         )
 
-        result = self.execute_query(query, parameters=properties or {})
-        return [
-            {
-                "relationship": self._convert_relationship(record["r"]),
-                "from_node": self._convert_node(record["a"]),
-                "to_node": self._convert_node(record["b"]),
-            }
-            for record in result
-        ]
-
-    def _build_label_match(
-        self, alias: str, labels: Union[str, List[str], None]
-    ) -> str:
+    @staticmethod
+    def _build_label_match(alias: str, labels: Union[str, List[str], None]) -> str:
         """构建标签匹配的Cypher片段"""
         if not labels:
             return ""
@@ -188,6 +767,17 @@ class Neo4jDB:
         :param remove_labels: 要删除的标签列表
         :return: 更新后的节点信息
         """
+        self._cache_discard(element_id)
+        query = self._update_node_query(properties, add_labels, remove_labels)
+        result = self.execute_query(
+            query, {"element_id": element_id, "props": properties or {}}
+        )
+        return self._convert_node(result[0]["n"])
+
+    @staticmethod
+    def _update_node_query(
+        properties: dict, add_labels: List[str] = None, remove_labels: List[str] = None
+    ) -> str:
         query_parts = ["MATCH (n) WHERE elementId(n) = $element_id"]
 
         if properties:
@@ -207,38 +797,150 @@ class Neo4jDB:
 
         query_parts.append("RETURN n")
         # query = "MATCH (n) WHERE elementId(n) = $element_id SET n += $props RETURN n"
-        query = " ".join(query_parts)
-        result = self.execute_query(
-            query, {"element_id": element_id, "props": properties or {}}
-        )
-        return self._convert_node(result[0]["n"])
+        return " ".join(query_parts)
 
     def delete_node(self, element_id: str):
         """删除节点及其所有关系"""
+        self._cache_discard(element_id)
         query = "MATCH (n) WHERE elementId(n) = $element_id DETACH DELETE n"
         self.execute_query(query, {"element_id": element_id})
 
+    def delete_all(self):
+        """删除全部节点和关系，分批提交，不能在显式事务中调用"""
+        self.execute_query(
+            "MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS"
+        )
+        if self.identity_cache is not None:
+            self.identity_cache.clear()
+
+    def export_snapshot(self, file_name: str, fetch_size: int = 1000) -> tuple:
+        """
+        将全部节点和关系流式写入快照文件（gzip 压缩的 JSON Lines，格式见 graph_snapshot.py）
+
+        元素ID、节点、关系三次读取在同一个读事务中依次进行；Neo4j 事务只保证读已提交，
+        导出期间其他事务新建的节点及其关系不在第一次读取的元素ID中，写入快照时跳过
+
+        :param file_name: 快照文件名
+        :param fetch_size: 每次从服务器拉取的记录数
+        :return: (节点数, 关系数)
+        """
+
+        def export(tx):
+            def stream(query: str, key: str):
+                for record in tx.run(query):
+                    yield self._convert_record(record)[key]
+
+            return write_snapshot(
+                file_name,
+                stream("MATCH (n) RETURN elementId(n) AS element_id", "element_id"),
+                stream("MATCH (n) RETURN n", "n"),
+                stream("MATCH ()-[r]->() RETURN r", "r"),
+            )
+
+        if self._transaction:
+            return export(self._transaction)
+        with self._driver.session(
+            database=self._database, fetch_size=fetch_size, default_access_mode=READ_ACCESS
+        ) as session:
+            with session.begin_transaction() as tx:
+                return export(tx)
+
+    def restore_snapshot(
+        self, file_name: str, batch_size: int = None, clear: bool = False
+    ) -> Dict[int, str]:
+        """
+        通过批量写入接口从快照恢复
+
+        :param file_name: 快照文件名
+        :param batch_size: 每条语句的行数，默认使用 self.batch_size
+        :param clear: 先删除库中已有的全部节点和关系，否则快照内容追加到现有图中
+        :return: 快照中的节点序号到新元素ID的映射
+        """
+        if clear:
+            self.delete_all()
+        return restore_snapshot(self, file_name, batch_size)
+
     def transaction(self) -> Transaction:
-        """获取事务对象（配合with语句使用）"""
+        """开启显式事务，提交或回滚前所有操作都通过该事务执行"""
         self._session = self._driver.session(database=self._database)
         self._transaction = self._session.begin_transaction()
+        self._flush_pending(committed=False)
         return self._transaction
 
     def commit(self):
         """提交事务"""
         if self._transaction:
-            self._transaction.commit()
-            self._session.close()
-            self._transaction = None
-            self._session = None
+            committed = False
+            try:
+                self._transaction.commit()
+                committed = True
+            finally:
+                self._flush_pending(committed)
+                self._session.close()
+                self._transaction = None
+                self._session = None
 
     def rollback(self):
         """回滚事务"""
         if self._transaction:
-            self._transaction.rollback()
-            self._session.close()
-            self._transaction = None
-            self._session = None
+            try:
+                self._transaction.rollback()
+            finally:
+                self._flush_pending(committed=False)
+                self._session.close()
+                self._transaction = None
+                self._session = None
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        在同一会话、同一显式写事务中执行 with 语句块内的所有操作，
+        正常退出时提交一次，出现异常时回滚；嵌套使用时并入外层事务
+
+        with db.unit_of_work():
+            db.merge_node(...)
+            db.create_relationship(...)
+        """
+        if self._transaction:
+            yield self
+            return
+        self.transaction()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
+
+    def write_transaction(self, work: Callable, *args, **kwargs):
+        """
+        通过 execute_write 执行 work(self, *args, **kwargs)，期间所有操作都走同一事务，
+        遇到瞬时错误（如死锁、主节点切换）时整体重试，因此 work 应可重复执行
+
+        :param work: 工作函数，第一个参数为本对象
+        :return: work 的返回值
+        """
+        if self._transaction:
+            return work(self, *args, **kwargs)
+
+        def run(tx):
+            # 重试时丢弃上一次尝试中合并的节点
+            self._flush_pending(committed=False)
+            self._transaction = tx
+            try:
+                return work(self, *args, **kwargs)
+            finally:
+                self._transaction = None
+
+        committed = False
+        try:
+            with self._driver.session(database=self._database) as session:
+                result = session.execute_write(run)
+            committed = True
+            return result
+        finally:
+            self._flush_pending(committed)
 
     @staticmethod
     def _convert_node(node) -> dict:
@@ -249,6 +951,21 @@ class Neo4jDB:
             "properties": dict(node),
         }
 
+    @classmethod
+    def _convert_record(cls, record) -> dict:
+        """将查询记录转换为字典，其中的节点、关系（包括列表中的）转换为字典"""
+        return {key: cls._convert_value(value) for key, value in record.items()}
+
+    @classmethod
+    def _convert_value(cls, value):
+        if isinstance(value, Node):
+            return cls._convert_node(value)
+        if isinstance(value, Relationship):
+            return cls._convert_relationship(value)
+        if isinstance(value, list):
+            return [cls._convert_value(v) for v in value]
+        return value
+
     @staticmethod
     def _convert_relationship(rel) -> dict:
         """将neo4j关系对象转换为字典"""
@@ -269,7 +986,12 @@ class Neo4jDB:
         :param add_labels: 要添加的标签列表
         :return: 复制的节点信息
         """
-        with self._driver.session() as session:
+        if self._transaction:
+            result = self._copy_node_and_relations(
+                self._transaction, element_id, update_props
+            )
+            return self._convert_node(result)
+        with self._driver.session(database=self._database) as session:
             result = session.execute_write(
                 self._copy_node_and_relations, element_id, update_props
             )
@@ -277,66 +999,56 @@ class Neo4jDB:
 
     @staticmethod
     def _copy_node_and_relations(tx, element_id: str, update_props: dict = None):
-        # 获取原始节点属性
-        node_result = list(
-            tx.run(
-                "MATCH (n) WHERE elementId(n) = $element_id RETURN n",
-                element_id=element_id,
-            )
-        )
+        """
+        语句数与关系数量无关：读取节点及全部关系 1 条，创建节点 1 条，
+        每种（方向, 关系类型）通过 UNWIND 批量创建 1 条
+        """
+        # 获取原始节点及其出向、入向关系
+        record = tx.run(COPY_READ_QUERY, element_id=element_id).single()
 
-        if not node_result:
+        if not record:
             raise ValueError(f"Node with elementId {element_id} not found")
-        node_record = node_result[0]["n"]
-        labels = list(node_record.labels)
-        label_str = ":".join(labels)
-        new_props = dict(node_record)
-        new_props.update(update_props)
+        query, new_props = Neo4jDB._copy_node_query(record["n"], update_props)
         # 创建新节点
-        new_node_result = list(
-            tx.run(
-                f"CREATE (n:{label_str} $properties) RETURN n",
-                properties=new_props,
-            )
-        )[0]["n"]
+        new_node_result = tx.run(query, properties=new_props).single()["n"]
         new_element_id = new_node_result.element_id
 
-        # 复制出向关系
-        out_rels = list(
-            tx.run(
-                "MATCH (n)-[r]->(m) WHERE elementId(n) = $element_id "
-                "RETURN type(r) as rel_type, properties(r) as rel_props, elementId(m) as target_id",
-                element_id=element_id,
-            )
-        )
-        for rel in out_rels:
-            tx.run(
-                "MATCH (src), (tgt) WHERE elementId(src) = $new_element_id AND elementId(tgt) = $target_id "
-                f"CREATE (src)-[r:{rel["rel_type"]} $rel_props]->(tgt)",
-                new_element_id=new_element_id,
-                target_id=rel["target_id"],
-                rel_props=rel["rel_props"] or {},
-            )
-
-        # 复制入向关系
-        in_rels = list(
-            tx.run(
-                "MATCH (m)-[r]->(n) WHERE elementId(n) = $element_id "
-                "RETURN type(r) as rel_type, properties(r) as rel_props, elementId(m) as source_id",
-                element_id=element_id,
-            )
-        )
-        for rel in in_rels:
-            tx.run(
-                "MATCH (src), (tgt) WHERE elementId(src) = $source_id AND elementId(tgt) = $new_element_id "
-                f"CREATE (src)-[r:{rel['rel_type']} $rel_props]->(tgt)",
-                source_id=rel["source_id"],
-                new_element_id=new_element_id,
-                rel_props=rel["rel_props"] or {},
-            )
+        for query, rows in Neo4jDB._copy_rel_queries(record):
+            tx.run(query, new_element_id=new_element_id, rows=rows).consume()
 
         return new_node_result
 
+    @staticmethod
+    def _copy_node_query(node_record: Node, update_props: dict = None):
+        """:return: (创建新节点的语句, 新节点属性)"""
+        label_str = ":".join(node_record.labels)
+        new_props = dict(node_record)
+        new_props.update(update_props or {})
+        return f"CREATE (n:{label_str} $properties) RETURN n", new_props
+
+    @staticmethod
+    def _copy_rel_queries(record) -> List[tuple[str, List[dict]]]:
+        """按（方向, 关系类型）分组，:return: [(UNWIND 创建关系的语句, rows)]"""
+        queries = []
+        for direction, rels in (("out", record["out_rels"]), ("in", record["in_rels"])):
+            groups = {}
+            for rel in rels:
+                groups.setdefault(rel["type"], []).append(
+                    {"other": rel["other"], "props": rel["props"] or {}}
+                )
+            pattern = "(src)-[r:{}]->(m)" if direction == "out" else "(m)-[r:{}]->(src)"
+            for rel_type, rows in groups.items():
+                queries.append(
+                    (
+                        "MATCH (src) WHERE elementId(src) = $new_element_id "
+                        "UNWIND $rows AS row "
+                        "MATCH (m) WHERE elementId(m) = row.other "
+                        f"CREATE {pattern.format(rel_type)} SET r = row.props",
+                        rows,
+                    )
+                )
+        return queries
+
 
 if __name__ == "__main__":
     db = Neo4jDB()
@@ -0,0 +1,237 @@
+"""usage: python feature_dedup.py <JSON_NAME> [THRESHOLD]
+
+Near-duplicate Feature consolidation. Every LLM rephrasing of a feature
+becomes its own Feature node; this clusters features whose shingle sets have a
+Jaccard similarity of at least THRESHOLD, in near-linear time with MinHash
+signatures and LSH banding, and maps each clustered feature to a canonical
+name. `commit2graph.ingest(..., canonical=...)` links clustered Feature nodes
+to a `CanonicalFeature` with `INSTANCE_OF` edges.
+
+The mapping is saved next to the knowledge JSON as `<JSON_NAME>.canonical.json`
+with the threshold it was computed for, so ingests load it instead of
+clustering the whole knowledge again; it is recomputed when the JSON or the
+threshold changes.
+"""
+import hashlib
+import json
+import random
+import re
+from collections import Counter, defaultdict
+from itertools import combinations
+from os import stat
+from sys import argv
+from typing import Iterable
+
+from features import file_add, file_mod
+
+THRESHOLD = 0.6
+CANONICAL_VERSION = 1
+NUM_PERM = 128
+# 32 bands of 4 rows: pairs at Jaccard 0.6 become candidates with p = 1 - (1 - 0.6^4)^32 = 0.99
+BANDS = 32
+# word n-grams of the explanation, 0 leaves it out: explanations of features
+# found in the same diff share most of their wording whatever the feature
+IDENT_K = 0
+# words naming the kind of code element rather than the feature
+STOP_WORDS = {
+    "a", "an", "and", "class", "code", "for", "function", "import", "in", "method",
+    "of", "statement", "the", "to", "update", "with",
+}
+_PRIME = (1 << 61) - 1
+
+
+def feature_key(name: str, ident) -> tuple[str, str]:
+    """hashable identity of a feature, idents may be lists"""
+    return name, ident if isinstance(ident, str) else json.dumps(ident)
+
+
+def knowledge_features(knowledge: dict) -> Iterable[tuple[str, object]]:
+    """`(name, ident)` of every feature occurrence in a `commits.py` knowledge JSON"""
+    for commit_knowledge in knowledge.values():
+        for fname, feat_dict in commit_knowledge.items():
+            if fname == "summary" or not isinstance(feat_dict, dict):
+                continue
+            if {"add", "delete", "modify"} & set(feat_dict):
+                feats = file_mod(feat_dict)
+            else:
+                feats = file_add(feat_dict)
+            for _, name, ident in feats:
+                yield name, ident
+
+
+def words(text) -> list[str]:
+    """lower case words, camelCase and snake_case split, plural `s` dropped"""
+    if not isinstance(text, str):
+        text = " ".join(str(t) for t in text) if isinstance(text, list) else str(text)
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return [
+        w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+        for w in re.findall(r"[0-9a-z]+", text.lower())
+    ]
+
+
+def shingles(name: str, ident, ident_k: int = IDENT_K) -> set[str]:
+    """words and word bigrams of the name, word `ident_k`-grams of the explanation"""
+    name_words = [w for w in words(name) if w not in STOP_WORDS] or words(name)
+    out = {"n:" + w for w in name_words}
+    out.update(f"n:{a} {b}" for a, b in zip(name_words, name_words[1:]))
+    if ident_k:
+        ident_words = words(ident)
+        out.update(
+            "i:" + " ".join(ident_words[i : i + ident_k])
+            for i in range(len(ident_words) - ident_k + 1)
+        )
+    return out or {"n:"}
+
+
+class MinHasher:
+    """`num_perm` hash functions `(a * x + b) mod p` over 64 bit shingle hashes"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rnd = random.Random(seed)
+        self.params = [
+            (rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, shingle_set: set[str]) -> tuple[int, ...]:
+        xs = [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little")
+            for s in shingle_set
+        ]
+        return tuple(min((a * x + b) % _PRIME for x in xs) for a, b in self.params)
+
+
+def lsh_candidates(signatures: list[tuple[int, ...]], bands: int = BANDS) -> set[tuple[int, int]]:
+    """index pairs sharing all rows of at least one band"""
+    rows = len(signatures[0]) // bands if signatures else 0
+    pairs = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, sig in enumerate(signatures):
+            buckets[sig[band * rows : (band + 1) * rows]].append(i)
+        for members in buckets.values():
+            pairs.update(combinations(members, 2))
+    return pairs
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def find_clusters(
+    features: Iterable[tuple[str, object]],
+    threshold: float = THRESHOLD,
+    num_perm: int = NUM_PERM,
+    bands: int = BANDS,
+):
+    """
+    group near-duplicate features
+
+    features are visited by occurrence count, most frequent first; each joins
+    the most similar cluster center among its LSH candidates whose exact
+    Jaccard similarity reaches `threshold`, or becomes a center itself.
+    Comparing with centers only keeps clusters from chaining through
+    intermediate features
+
+    :return: (clusters of at least two `feature_key`s with occurrence counts, number of candidate pairs)
+    """
+    counts = Counter()
+    idents = {}
+    for name, ident in features:
+        key = feature_key(name, ident)
+        counts[key] += 1
+        idents[key] = ident
+    keys = list(counts)
+    sets = [shingles(key[0], idents[key]) for key in keys]
+    hasher = MinHasher(num_perm)
+    candidates = lsh_candidates([hasher.signature(s) for s in sets], bands)
+
+    neighbors = defaultdict(list)
+    for i, j in candidates:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    center = {}
+    for i in sorted(range(len(keys)), key=lambda i: (-counts[keys[i]], len(keys[i][0]))):
+        similarity, best = max(
+            ((jaccard(sets[i], sets[j]), j) for j in neighbors[i] if center.get(j) == j),
+            default=(0, i),
+        )
+        center[i] = best if similarity >= threshold else i
+    groups = defaultdict(list)
+    for i, key in enumerate(keys):
+        groups[center[i]].append((key, counts[key]))
+    return [group for group in groups.values() if len(group) > 1], len(candidates)
+
+
+def canonical_names(clusters: list[list[tuple[tuple[str, str], int]]]) -> dict[tuple[str, str], str]:
+    """`feature_key` -> canonical name, the most frequent (then shortest) name of its cluster"""
+    canonical = {}
+    for cluster in clusters:
+        names = Counter()
+        for (name, _), count in cluster:
+            names[name] += count
+        best = min(names, key=lambda n: (-names[n], len(n), n))
+        for key, _ in cluster:
+            canonical[key] = best
+    return canonical
+
+
+def consolidate(knowledge: dict, threshold: float = THRESHOLD, **kwargs) -> dict[tuple[str, str], str]:
+    """canonical name of every clustered feature of `knowledge`, see `find_clusters`"""
+    clusters, _ = find_clusters(knowledge_features(knowledge), threshold, **kwargs)
+    return canonical_names(clusters)
+
+
+def _source_stamp(file_name_no_ext: str) -> dict:
+    st = stat(file_name_no_ext + ".json")
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def save_canonical(file_name_no_ext: str, canonical: dict[tuple[str, str], str], threshold: float):
+    file_name = file_name_no_ext + ".canonical.json"
+    print(f"saving {len(canonical)} canonical names > {file_name}")
+    with open(file_name, "w") as fp:
+        json.dump(
+            {
+                "version": CANONICAL_VERSION,
+                "threshold": threshold,
+                **_source_stamp(file_name_no_ext),
+                "features": [[name, ident, best] for (name, ident), best in canonical.items()],
+            },
+            fp,
+        )
+
+
+def load_canonical(file_name_no_ext: str, threshold: float = THRESHOLD) -> dict | None:
+    """the saved mapping, None when missing or computed for another JSON or threshold"""
+    try:
+        with open(file_name_no_ext + ".canonical.json") as fp:
+            data = json.load(fp)
+    except FileNotFoundError:
+        return None
+    expected = {"version": CANONICAL_VERSION, "threshold": threshold, **_source_stamp(file_name_no_ext)}
+    if any(data.get(k) != v for k, v in expected.items()):
+        return None
+    return {(name, ident): best for name, ident, best in data["features"]}
+
+
+def canonical_for(file_name_no_ext: str, knowledge: dict, threshold: float = THRESHOLD) -> dict:
+    """`load_canonical`, `consolidate` and save when there is no up to date mapping"""
+    canonical = load_canonical(file_name_no_ext, threshold)
+    if canonical is None:
+        canonical = consolidate(knowledge, threshold)
+        save_canonical(file_name_no_ext, canonical, threshold)
+    return canonical
+
+
+if __name__ == "__main__":
+    JSON_NAME = argv[1]
+    threshold = float(argv[2]) if len(argv) > 2 else THRESHOLD
+    with open(JSON_NAME + ".json") as f:
+        knowledge = json.load(f)
+    clusters, n_candidates = find_clusters(knowledge_features(knowledge), threshold)
+    canonical = canonical_names(clusters)
+    save_canonical(JSON_NAME, canonical, threshold)
+    print(f"{n_candidates} candidate pairs, {len(clusters)} clusters of {len(canonical)} features")
+    for cluster in sorted(clusters, key=len, reverse=True)[:20]:
+        print(canonical[cluster[0][0]], "<-", sorted({key[0] for key, _ in cluster}))
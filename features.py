@@ -0,0 +1,56 @@
+"""features of the knowledge JSON written by `commits.py`, shared by ingestion and consolidation"""
+import json
+
+
+def feat_list(kind: str, feat_dict: dict):
+    """`(kind, feature, ident)` of every meaningful feature in `feat_dict`"""
+    return [
+        (kind, feat, storable_ident(ident))
+        for feat, ident in feat_dict.items()
+        if not chk_no_in_str(feat) and not isinstance(ident, dict)
+    ]
+
+
+def storable_ident(ident):
+    """
+    `ident` as a value Neo4j can store: lists must hold items of one primitive
+    type, nested or mixed lists (e.g. `["str", ["a", "b"]]`) become JSON text
+    """
+    if isinstance(ident, list) and (
+        len({type(i) for i in ident}) > 1
+        or any(isinstance(i, (list, dict)) for i in ident)
+    ):
+        return json.dumps(ident)
+    return ident
+
+
+def file_add(feat_dict: dict[str, object]):
+    if not isinstance(feat_dict, dict):
+        return []
+    return feat_list("add", feat_dict)
+
+
+def file_del(feat_dict: dict[str, object]):
+    if not isinstance(feat_dict, dict):
+        return []
+    return feat_list("delete", feat_dict)
+
+
+def file_mod(feat_dict: dict[str, dict]):
+    if not isinstance(feat_dict, dict):
+        return []
+    feats = []
+    if "add" in feat_dict:
+        feats.extend(file_add(feat_dict["add"]))
+    if "delete" in feat_dict:
+        feats.extend(file_del(feat_dict["delete"]))
+    if "modify" in feat_dict and isinstance(feat_dict["modify"], dict):
+        feats.extend(feat_list("modify", feat_dict["modify"]))
+    return feats
+
+
+def chk_no_in_str(s: str):
+    lowered = s[:min(8, len(s))].lower()
+    if lowered.find("no") != -1 and lowered[0].isalpha():
+        return True
+    return False
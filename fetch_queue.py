@@ -0,0 +1,176 @@
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time, sleep
+from typing import Callable, Iterable
+
+PENDING, RUNNING, DONE, DEAD = "pending", "running", "done", "dead"
+
+
+class FetchQueue:
+    """
+    Persistent work queue of urls backed by SQLite.
+
+    Every item keeps its status, attempt count, last error and the time it
+    becomes eligible again. A claimed item is leased, so items left `running`
+    by a crashed worker are picked up again once the lease expires.
+    """
+
+    def __init__(
+        self,
+        db_file: str,
+        max_attempts: int = 6,
+        backoff: float = 30,
+        max_backoff: float = 3600,
+        lease: float = 600,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                url TEXT PRIMARY KEY,
+                payload TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_eligible REAL NOT NULL DEFAULT 0,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS items_status ON items (status, next_eligible);
+            """
+        )
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM items").fetchone()[0]
+
+    def enqueue(self, items: Iterable[tuple[str, object]]) -> int:
+        """add `(url, payload)` items, urls already queued are kept as they are; return the number added"""
+        with self._lock, self._conn:
+            return self._conn.executemany(
+                "INSERT OR IGNORE INTO items (url, payload) VALUES (?, ?)",
+                [(url, json.dumps(payload)) for url, payload in items],
+            ).rowcount
+
+    def claim(self, limit: int = 1) -> list[tuple[str, object]]:
+        """lease up to `limit` eligible items"""
+        now = time()
+        with self._lock, self._conn:
+            # take the write lock before reading so other processes cannot claim the same rows
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT url, payload FROM items "
+                "WHERE status IN (?, ?) AND next_eligible <= ? "
+                "ORDER BY next_eligible LIMIT ?",
+                (PENDING, RUNNING, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE items SET status = ?, next_eligible = ? WHERE url = ?",
+                [(RUNNING, now + self.lease, url) for url, _ in rows],
+            )
+        return [(url, json.loads(payload)) for url, payload in rows]
+
+    def complete(self, url: str, result: object = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE items SET status = ?, result = ?, last_error = NULL WHERE url = ?",
+                (DONE, json.dumps(result), url),
+            )
+
+    def fail(self, url: str, error: str, transient: bool = True):
+        """record a failure, transient ones are retried with exponential backoff"""
+        with self._lock, self._conn:
+            (attempts,) = self._conn.execute(
+                "SELECT attempts + 1 FROM items WHERE url = ?", (url,)
+            ).fetchone()
+            dead = not transient or attempts >= self.max_attempts
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            self._conn.execute(
+                "UPDATE items SET status = ?, attempts = ?, last_error = ?, next_eligible = ? "
+                "WHERE url = ?",
+                (DEAD if dead else PENDING, attempts, error, time() + delay, url),
+            )
+
+    def retry_dead(self):
+        """make items that ran out of attempts eligible again"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE items SET status = ?, attempts = 0, next_eligible = 0 WHERE status = ?",
+                (PENDING, DEAD),
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(
+                self._conn.execute("SELECT status, count(*) FROM items GROUP BY status")
+            )
+
+    def next_eligible(self) -> float | None:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT min(next_eligible) FROM items WHERE status IN (?, ?)",
+                (PENDING, RUNNING),
+            ).fetchone()[0]
+
+    def results(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM items WHERE status = ? ORDER BY url DESC", (DONE,)
+            ).fetchall()
+        for (result,) in rows:
+            yield json.loads(result)
+
+    def errors(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT url, status, attempts, last_error FROM items WHERE last_error IS NOT NULL"
+            ).fetchall()
+
+    def drain(
+        self,
+        worker: Callable[[object], object],
+        classify: Callable[[Exception], bool] = lambda e: True,
+        max_workers: int = 8,
+        max_wait: float = 300,
+    ):
+        """
+        run `worker(payload)` over eligible items with `max_workers` threads
+
+        `classify(error)` tells whether a failure is transient; the queue is
+        drained until no item becomes eligible within `max_wait` seconds
+        """
+
+        def work():
+            done = 0
+            while True:
+                claimed = self.claim()
+                if not claimed:
+                    return done
+                url, payload = claimed[0]
+                try:
+                    result = worker(payload)
+                except Exception as e:
+                    print(f"failed {url}: {e}")
+                    self.fail(url, f"{type(e).__name__}: {e}", classify(e))
+                else:
+                    self.complete(url, result)
+                    done += 1
+
+        while True:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = [pool.submit(work) for _ in range(max_workers)]
+                done = sum(f.result() for f in futures)
+            print(f"Drained {done} items, queue: {self.counts()}")
+            next_eligible = self.next_eligible()
+            if next_eligible is None or next_eligible - time() > max_wait:
+                return self.counts()
+            sleep(max(0, next_eligible - time()))
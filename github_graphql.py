@@ -0,0 +1,180 @@
+"""usage: python github_graphql.py <REPO> <TOKEN>
+
+Bulk alternative to `github_issues.py`: issues and pull requests are listed
+100 per request together with their labels and comments via the Github
+GraphQL API, then written to `<REPO>_issues_merged.json` in the REST shape
+`chat_issues` consumes.
+"""
+import json
+import requests
+from sys import argv
+from os import chdir, path, getenv
+
+from github_issues import (
+    SESSION,
+    RATE_LIMITER,
+    TIMEOUT,
+    is_rate_limited,
+    save_to_json,
+)
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+PAGE_SIZE = 100
+
+COMMENT_FIELDS = """
+totalCount
+pageInfo { hasNextPage endCursor }
+nodes { url body createdAt updatedAt author { login } }
+"""
+
+THREAD_FIELDS = f"""
+id number title body state url createdAt updatedAt closedAt
+author {{ login }}
+labels(first: 100) {{ nodes {{ name }} }}
+comments(first: {PAGE_SIZE}) {{ {COMMENT_FIELDS} }}
+"""
+
+THREADS_QUERY = f"""
+query($owner: String!, $name: String!, $cursor: String) {{
+  rateLimit {{ cost remaining }}
+  repository(owner: $owner, name: $name) {{
+    %s(first: {PAGE_SIZE}, after: $cursor, orderBy: {{field: CREATED_AT, direction: DESC}}) {{
+      pageInfo {{ hasNextPage endCursor }}
+      nodes {{ {THREAD_FIELDS} }}
+    }}
+  }}
+}}
+"""
+
+COMMENTS_QUERY = f"""
+query($id: ID!, $cursor: String) {{
+  node(id: $id) {{
+    ... on Issue {{ comments(first: {PAGE_SIZE}, after: $cursor) {{ {COMMENT_FIELDS} }} }}
+    ... on PullRequest {{ comments(first: {PAGE_SIZE}, after: $cursor) {{ {COMMENT_FIELDS} }} }}
+  }}
+}}
+"""
+
+
+def post_graphql(query: str, variables: dict, token: str, max_retries: int = 5):
+    for attempt in range(max_retries):
+        RATE_LIMITER.acquire()
+        response = None
+        try:
+            response = SESSION.post(
+                GRAPHQL_URL,
+                json={"query": query, "variables": variables},
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=TIMEOUT,
+            )
+        finally:
+            RATE_LIMITER.release(response)
+        if not is_rate_limited(response) or attempt == max_retries - 1:
+            break
+        RATE_LIMITER.backoff(response, attempt)
+    response.raise_for_status()
+    data = response.json()
+    if data.get("errors"):
+        raise requests.exceptions.RequestException(
+            f"GraphQL error: {data['errors']}", response=response
+        )
+    return data["data"]
+
+
+def list_threads(owner_repo: str, token: str, kind: str = "issues"):
+    """yield every issue (or pull request if `kind` is `pullRequests`) with all comments"""
+    owner, name = owner_repo.split("/", 1)
+    cursor, page = None, 0
+    while True:
+        data = post_graphql(
+            THREADS_QUERY % kind,
+            {"owner": owner, "name": name, "cursor": cursor},
+            token,
+        )
+        threads = data["repository"][kind]
+        page += 1
+        print(f"List {len(threads['nodes'])} {kind} from page {page}")
+        for node in threads["nodes"]:
+            comments = node["comments"]
+            while comments["pageInfo"]["hasNextPage"]:
+                more = post_graphql(
+                    COMMENTS_QUERY,
+                    {"id": node["id"], "cursor": comments["pageInfo"]["endCursor"]},
+                    token,
+                )["node"]["comments"]
+                comments["nodes"].extend(more["nodes"])
+                comments["pageInfo"] = more["pageInfo"]
+            yield node
+        if not threads["pageInfo"]["hasNextPage"]:
+            break
+        cursor = threads["pageInfo"]["endCursor"]
+
+
+def _user(author: dict | None):
+    # deleted accounts come back as `null`
+    return {"login": author["login"] if author else "ghost"}
+
+
+def to_rest_issue(owner_repo: str, node: dict, pull_request: bool = False):
+    """convert a GraphQL issue / pull request to the REST `issues` JSON shape"""
+    api_url = f"https://api.github.com/repos/{owner_repo}/issues/{node['number']}"
+    comments = [
+        {
+            "html_url": c["url"],
+            "user": _user(c["author"]),
+            "body": c["body"],
+            "created_at": c["createdAt"],
+            "updated_at": c["updatedAt"],
+        }
+        for c in node["comments"]["nodes"]
+    ]
+    issue = {
+        "url": api_url,
+        "comments_url": api_url + "/comments",
+        "html_url": node["url"],
+        "node_id": node["id"],
+        "number": node["number"],
+        "title": node["title"],
+        "user": _user(node["author"]),
+        "labels": [{"name": l["name"]} for l in node["labels"]["nodes"]],
+        "state": "open" if node["state"] == "OPEN" else "closed",
+        "comments": comments if comments else 0,
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "closed_at": node["closedAt"],
+        "body": node["body"],
+    }
+    if pull_request:
+        issue["pull_request"] = {
+            "url": f"https://api.github.com/repos/{owner_repo}/pulls/{node['number']}",
+            "html_url": node["url"],
+        }
+    return issue
+
+
+def get_repo_issue_comments(owner_repo: str, token: str, pull_requests: bool = True):
+    """list issues (and pull requests) with comments, sorted by url descending"""
+    issues = [to_rest_issue(owner_repo, n) for n in list_threads(owner_repo, token)]
+    if pull_requests:
+        issues.extend(
+            to_rest_issue(owner_repo, n, pull_request=True)
+            for n in list_threads(owner_repo, token, "pullRequests")
+        )
+    issues.sort(key=lambda issue: issue["url"], reverse=True)
+    return issues
+
+
+if __name__ == "__main__":
+    chdir(path.dirname(__file__))
+    if len(argv) > 2:
+        REPO, TOKEN = argv[1], argv[2]
+    else:
+        REPO = input("Please enter Github repo (e.g. octocat/Hello-World): \n").strip()
+        github_api_key = getenv("github_api_key")
+        if github_api_key:
+            TOKEN = github_api_key
+        else:
+            TOKEN = input("Please enter Github token: \n").strip()
+    MERGED_FILE = REPO.replace("/", "_", 1) + "_issues_merged.json"
+
+    save_to_json(MERGED_FILE, get_repo_issue_comments(REPO, TOKEN))
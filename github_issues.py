@@ -1,47 +1,254 @@
 """usage: python github_issues.py <REPO> <TOKEN>"""
 import json
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+from time import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from sys import argv
-from os import chdir, path, getenv
+from os import chdir, path, getenv, makedirs, replace
 
+from fetch_queue import FetchQueue
 
-def get(url: str, token: str):
-    """Github API limit is easier to reach without token"""
-    response = requests.get(
-        url=url,
-        headers={
+
+TIMEOUT = 30
+CACHE_DIR = ".github_cache"
+# headers replayed from the cache on a 304, the body alone is not enough for pagination
+CACHED_HEADERS = ("Content-Type", "Link", "ETag", "Last-Modified")
+
+
+def new_session(pool_maxsize: int = 32):
+    """one keep-alive connection pool shared by every request to api.github.com"""
+    session = requests.Session()
+    session.headers.update(
+        {
             "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {token}",
             "X-GitHub-Api-Version": "2022-11-28",
-        },
+        }
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)
+        ),
     )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ETagCache:
+    """
+    On-disk cache of GET responses keyed by url.
+
+    Cached entries are revalidated with `If-None-Match` / `If-Modified-Since`,
+    a `304 Not Modified` does not count against the Github rate limit.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _file(self, url: str):
+        return path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def load(self, url: str) -> dict | None:
+        try:
+            with open(self._file(url), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def save(self, url: str, response: requests.Response):
+        headers = {k: response.headers[k] for k in CACHED_HEADERS if k in response.headers}
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return
+        makedirs(self.cache_dir, exist_ok=True)
+        fname = self._file(url)
+        with open(fname + ".tmp", "w") as f:
+            json.dump({"url": url, "headers": headers, "body": response.text}, f)
+        replace(fname + ".tmp", fname)
+
+    @staticmethod
+    def conditional_headers(entry: dict):
+        headers = {}
+        if "ETag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    @staticmethod
+    def to_response(entry: dict, not_modified: requests.Response):
+        """rebuild a `200` response from `entry`, keeping the fresh rate limit headers"""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = entry["url"]
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        response.headers = CaseInsensitiveDict(not_modified.headers)
+        response.headers.update(entry["headers"])
+        response.from_cache = True
+        return response
+
+
+class RateLimiter:
+    """
+    Bounds in-flight requests, adapting to Github rate limit headers.
+
+    Concurrency shrinks as `X-RateLimit-Remaining` approaches `reserve`,
+    all workers wait for `X-RateLimit-Reset` once it is reached, and a
+    secondary rate limit pauses everyone and halves concurrency.
+    """
+
+    def __init__(self, max_workers: int = 8, reserve: int = 50):
+        self.max_workers = max_workers
+        self.reserve = reserve
+        self.limit = max_workers
+        self.in_flight = 0
+        self.remaining = None
+        self.reset_at = 0.0
+        self.pause_until = 0.0
+        self._cond = Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time()
+                wait = self.pause_until - now
+                if self.remaining is not None and self.remaining <= self.reserve:
+                    wait = max(wait, self.reset_at - now)
+                if wait > 0:
+                    print(f"rate limited, waiting {wait:.0f}s")
+                    self._cond.wait(wait)
+                elif self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                else:
+                    self._cond.wait()
+
+    def release(self, response: requests.Response | None = None):
+        with self._cond:
+            self.in_flight -= 1
+            if response is not None:
+                self._update(response.headers)
+            self._cond.notify_all()
+
+    def _update(self, headers):
+        remaining, reset = headers.get("X-RateLimit-Remaining"), headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        self.remaining, self.reset_at = int(remaining), float(reset)
+        if self.remaining > self.reserve:
+            self.limit = max(1, min(self.max_workers, self.remaining // self.reserve))
+
+    def backoff(self, response: requests.Response, attempt: int):
+        headers = response.headers
+        if "Retry-After" in headers:
+            delay = float(headers["Retry-After"])
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            delay = float(headers.get("X-RateLimit-Reset", 0)) - time() + 1
+        else:  # secondary rate limit without a hint, wait at least one minute
+            delay = 60 * (attempt + 1)
+        with self._cond:
+            self.pause_until = max(self.pause_until, time() + delay)
+            self.limit = max(1, self.limit // 2)
+            self._cond.notify_all()
+
+
+def is_rate_limited(response: requests.Response | None):
+    if response is None or response.status_code not in (403, 429):
+        return False
+    return (
+        "Retry-After" in response.headers
+        or response.headers.get("X-RateLimit-Remaining") == "0"
+        or "rate limit" in response.text.lower()
+    )
+
+
+SESSION = new_session()
+ETAG_CACHE = ETagCache()
+RATE_LIMITER = RateLimiter()
+
+
+def get(
+    url: str,
+    token: str,
+    cache: ETagCache | None = ETAG_CACHE,
+    limiter: RateLimiter = RATE_LIMITER,
+    max_retries: int = 5,
+):
+    """Github API limit is easier to reach without token"""
+    headers = {"Authorization": f"Bearer {token}"}
+    entry = cache.load(url) if cache else None
+    if entry:
+        headers.update(cache.conditional_headers(entry))
+    for attempt in range(max_retries):
+        limiter.acquire()
+        response = None
+        try:
+            response = SESSION.get(url=url, headers=headers, timeout=TIMEOUT)
+        finally:
+            limiter.release(response)
+        if not is_rate_limited(response) or attempt == max_retries - 1:
+            break
+        limiter.backoff(response, attempt)
+    if response.status_code == 304 and entry:
+        return cache.to_response(entry, response)
     response.raise_for_status()
+    if cache and response.status_code == 200:
+        cache.save(url, response)
     return response
 
 
+def with_per_page(url: str, per_page: int = 100):
+    """add `per_page` to `url` unless it is already set"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query)
+    if not any(k == "per_page" for k, _ in query):
+        query.append(("per_page", str(per_page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+# https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api
+def iter_pages(url: str, token: str):
+    """
+    yield JSON pages of `url` following `Link: rel="next"`,
+    the next page is fetched in the background while the current one is processed
+    """
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        future = prefetch.submit(get, url, token)
+        while future:
+            response = future.result()
+            next_url = response.links.get("next", {}).get("url")
+            future = prefetch.submit(get, next_url, token) if next_url else None
+            yield response.json()
+
+
+def paginate(url: str, token: str):
+    """stream every item of a paginated list"""
+    for page in iter_pages(with_per_page(url), token):
+        yield from page
+
+
 # https://docs.github.com/en/rest/issues/issues?apiVersion=2022-11-28#list-repository-issues
 def list_repo_issues(owner_repo: str, token: str):
     json_list = []
-    index = 0
-    base_url = (
-        f"https://api.github.com/repos/{owner_repo}/issues?state=all&per_page=100&page="
-    )
-    while True:
-        try:
-            response = get(f"{base_url}{index}&sort=created", token)
-        except requests.exceptions.RequestException as e:
-            print(e)
-        if response.status_code == 200:
-            if len(response.json()) > 0:
-                json_list.append(response.json())
-                print("List 100 issues from page {}".format(index))
-                index += 1
-            else:
-                print("List all issues successfully")
-                break
-        else:
-            print("Stop listing issues at page {}: {}".format(index, response.text))
-            break
+    url = f"https://api.github.com/repos/{owner_repo}/issues?state=all&per_page=100&sort=created"
+    try:
+        for page in iter_pages(url, token):
+            json_list.append(page)
+            print("List {} issues from page {}".format(len(page), len(json_list)))
+    except requests.exceptions.RequestException as e:
+        print("Stop listing issues at page {}: {}".format(len(json_list) + 1, e))
+    else:
+        print("List all issues successfully")
     return json_list
 
 
@@ -66,21 +273,6 @@ def get_an_issue(
         raise e
 
 
-# https://docs.github.com/en/rest/issues/issues?apiVersion=2022-11-28#list-repository-issues
-def extract_issue_urls(file: str, failed_file: str):
-    """extract todo issue_urls from `file`, return `None` if `failed_file` exists"""
-    issue_urls = []
-    with open(file, "r") as f:
-        repo_issue_list = json.load(f)
-        if not isinstance(repo_issue_list, list):
-            raise TypeError(f"Invalid JSON format: {file}")
-        for i, page in enumerate(repo_issue_list):
-            if not isinstance(page, list):
-                print(f"Invalid JSON format: page {i+1} @ {file}")
-            issue_urls.extend([issue.get("url") for issue in page])
-    return issue_urls
-
-
 # https://docs.github.com/zh/rest/issues/comments?apiVersion=2022-11-28#list-issue-comments
 # "body" "user.login"
 def list_issue_comments(
@@ -90,13 +282,13 @@ def list_issue_comments(
     comments_url: str | None = None,
 ):
     if not comments_url:
-        comments_url = f"https://api.github.com/repos/{owner_repo}/issues/{issue_number}/comments?per_page=100"
+        comments_url = f"https://api.github.com/repos/{owner_repo}/issues/{issue_number}/comments"
     try:
-        response = get(comments_url, token)
-        if response.status_code == 200 and len(response.json()) > 0:
-            return response.json()
+        comments = list(paginate(comments_url, token))
+        if len(comments) > 0:
+            return comments
         else:
-            print(f"error getting comments {comments_url}: {response.text}")
+            print(f"error getting comments {comments_url}: no comments")
     except requests.exceptions.RequestException as e:
         print(e)
         raise e
@@ -110,67 +302,82 @@ def save_to_json(file_name: str, json_data: list):
             json.dump(json_data, fp, indent=4)
 
 
-def get_repo_issue_comments_from_json_file(file: str, failed_file: str, token: str):
-    if not file:
-        file = FNAME_BASE + ".json"
-    failed_urls, issue_with_comments = [], []
-    failed_data = None
-    if path.exists(failed_file):
-        with open(failed_file, "r") as fail:
-            failed_data = json.load(fail)
+def attach_comments(issue: dict, token: str):
+    """return a copy of `issue` (from a list page) with its comments fetched"""
+    issue_json = dict(issue)
+    if issue.get("comments") and int(issue["comments"]) > 0:
+        issue_comments = list_issue_comments(token, comments_url=issue.get("comments_url"))
+        if issue_comments:
+            issue_json["comments"] = issue_comments
+    return issue_json
+
+
+def is_transient(error: Exception):
+    """
+    5xx, timeouts, rate limits and dropped connections are worth retrying;
+    other client errors (bad token, 404 / 410 / 422) and bad payloads are not
+    """
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429) or is_rate_limited(error.response)
+    return isinstance(
+        error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    )
+
+
+def fetch_issue_comments(issues: list[dict], token: str, max_workers: int = 8):
+    """
+    attach comments to `issues` taken from list pages, fetching concurrently
+
+    the list payload already holds every issue field, so only issues with
+    comments cost a request; in-flight requests are bounded by `max_workers`
+    here and by `RATE_LIMITER` across calls
+    """
+    issue_with_comments, failed_urls = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(attach_comments, issue, token) for issue in issues]
+        n = len(issues)
+        for i, (issue, future) in enumerate(zip(issues, futures)):
+            try:
+                issue_with_comments.append(future.result())
+            except Exception as e:
+                print(f"error getting comments of {issue.get('url')}: {e}")
+                failed_urls.append(issue.get("url"))
+            if (i + 1) % 100 == 0:
+                print(f"Got comments of {i + 1} / {n} issues")
+    return issue_with_comments, failed_urls
+
+
+def enqueue_issues_from_json_file(queue: FetchQueue, file: str, todo_file: str):
+    """queue every issue of list pages in `file`, or only the urls of a legacy `todo_file`"""
     with open(file, "r") as f:
         data = json.load(f)
-        failed_set = set()
-        if isinstance(failed_data, list):
-            failed_set.__init__(failed_data)
-        if not isinstance(data, list):
-            raise TypeError(f"Invalid JSON format: {file}")
-        l = len(data)
-        for i, page in enumerate(data):
-            print(f"Getting issues from page {i+1} / {l}")
-            if not isinstance(page, list):
-                print(f"Invalid JSON format: page {i+1} @ {file}")
+    if not isinstance(data, list):
+        raise TypeError(f"Invalid JSON format: {file}")
+    todo = None
+    if path.exists(todo_file):
+        with open(todo_file, "r") as f:
+            todo = set(json.load(f))
+    items = []
+    for i, page in enumerate(data):
+        if not isinstance(page, list):
+            print(f"Invalid JSON format: page {i+1} @ {file}")
+            continue
+        for j, issue in enumerate(page):
+            if not isinstance(issue, dict):
+                print(f"Invalid JSON format: {issue} @ line {j+1}, page {i+1} @ {file}")
                 continue
-            for j, issue in enumerate(page):
-                if not isinstance(issue, dict):
-                    print(f"Invalid JSON format: {issue} @ line {j+1}, page {i+1} @ {file}")
-                    continue
-                try:
-                    url = issue.get("url")
-                    if not url in failed_set:
-                        continue
-                    issue_json = get_an_issue(token, issue_url=url)
-                    cm = issue.get("comments")
-                    if cm and int(cm) > 0:
-                        issue_comments = list_issue_comments(
-                            token,
-                            comments_url=issue.get("comments_url"),
-                        )
-                        if issue_comments:
-                            issue_json["comments"] = issue_comments
-                    issue_with_comments.append(issue_json)
-                except:
-                    failed_urls.append(issue.get("url"))
-    return issue_with_comments, failed_urls
+            if todo is None or issue.get("url") in todo:
+                items.append((issue.get("url"), issue))
+    added = queue.enqueue(items)
+    print(f"Queued {added} new issues, {len(items) - added} already queued")
 
 
 def merge_issue_lists(a: list[dict], b: list[dict]):
-    """sort by url descending"""
-    merged = []
-    i, j = 0, 0
-    la, lb = len(a), len(b)
-    while i < la and j < lb:
-        if a[i].get("url") < b[j].get("url"):
-            merged.append(b[j])
-            j += 1
-        else:
-            merged.append(a[i])
-            i += 1
-    if i < la:
-        merged.extend(a[i:])
-    if j < lb:
-        merged.extend(b[j:])
-    return merged
+    """merge by url, issues in `a` replace those in `b`, sort by url descending"""
+    merged = {issue.get("url"): issue for issue in b}
+    merged.update((issue.get("url"), issue) for issue in a)
+    return sorted(merged.values(), key=lambda issue: issue.get("url") or "", reverse=True)
 
 
 if __name__ == "__main__":
@@ -186,7 +393,8 @@ if __name__ == "__main__":
             TOKEN = input("Please enter Github token: \n").strip()
     FNAME_BASE = REPO.replace("/", "_", 1)
     JSON_FILE = FNAME_BASE + ".json"
-    FAILED_FILE = FNAME_BASE + "_todo.json"
+    TODO_FILE = FNAME_BASE + "_todo.json"
+    QUEUE_FILE = FNAME_BASE + "_queue.sqlite"
     MERGED_FILE = FNAME_BASE + "_issues_merged.json"
 
     # list repo issues
@@ -196,18 +404,19 @@ if __name__ == "__main__":
     else:
         print(f"{JSON_FILE} alredy exists, skipping list_repo_issues()")
 
+    queue = FetchQueue(QUEUE_FILE)
+    try:
+        # issues already queued are skipped by url, new ones of a later listing are added
+        enqueue_issues_from_json_file(queue, JSON_FILE, TODO_FILE)
+        print(f"{QUEUE_FILE}: {queue.counts()}")
 
-    if not path.exists(FAILED_FILE):
-        issue_urls = extract_issue_urls(JSON_FILE, FAILED_FILE)
-        save_to_json(FAILED_FILE, issue_urls)
-    else:
-        print(f"{FAILED_FILE} alredy exists, skipping extract_issue_urls()")
-
-    # get issue comments
-    repo_issue_comments, failed = get_repo_issue_comments_from_json_file(
-        JSON_FILE, FAILED_FILE, TOKEN
-    )
-    save_to_json(FAILED_FILE, failed)
+        # get issue comments
+        queue.drain(lambda issue: attach_comments(issue, TOKEN), is_transient)
+        for url, status, attempts, error in queue.errors():
+            print(f"{status} after {attempts} attempts: {url} {error}")
+        repo_issue_comments = list(queue.results())
+    finally:
+        queue.close()
     if not path.exists(MERGED_FILE):
         # successfully get all issues with comments in one go
         save_to_json(MERGED_FILE, repo_issue_comments)
@@ -217,4 +426,3 @@ if __name__ == "__main__":
             # merge results from last time
             merged = merge_issue_lists(repo_issue_comments, issues)
             save_to_json(MERGED_FILE, merged)
-
@@ -0,0 +1,324 @@
+"""usage: python graph_import.py <REPO_NAME> <JSON_NAME> [OUT_DIR]
+
+Export a repository's commit graph as node / relationship CSV files for
+`neo4j-admin database import full`, for first-time loads and full rebuilds.
+The transactional path in `commit2graph.py` is then only needed for
+incremental updates. Commits are read from the metadata sidecar
+`<JSON_NAME>.meta.json` when it exists, from the repository otherwise.
+
+Ids are stable across runs: a commit is its hash, a user `name <email>`, a
+file change `CHANGE_TYPE:file_name@modify_in`, and a feature a digest of its
+properties. `*_by` properties of features hold the file change id rather
+than a database element id.
+
+The rollups of `aggregates.py` are computed with the same `Aggregator` and the
+near-duplicate features linked to their CanonicalFeature with the same
+mapping (`feature_dedup.canonical_for`, DEDUP_THRESHOLD in the environment)
+as the transactional path, so the imported graph needs no further pass.
+
+A column holding lists in some rows only (e.g. feature idents) is written to
+a separate node file with an array type, so every property gets the type the
+transactional path stores. Array elements and labels are separated by
+ARRAY_DELIMITER, a control character that does not occur in the knowledge
+text.
+"""
+import csv
+import hashlib
+from collections import defaultdict
+from datetime import datetime
+from sys import argv
+from os import path, chdir, getenv, makedirs
+
+from pydriller import Repository
+
+from aggregates import Aggregator
+from commit2graph import commit_subgraph, load_json, FEAT_RELS
+from commit_index import CommitIndex
+from commit_meta import commit_record, load_meta
+from feature_dedup import THRESHOLD, canonical_for, feature_key
+from lineage import PathLineage
+
+# header of each node file, `:ID` columns use one id space per label; the id
+# is stored as a property only where it is one (`Commit.name`)
+NODE_HEADERS = {
+    "Commit": [
+        "name:ID(Commit)",
+        "author_name",
+        "author_email",
+        "author_date:datetime",
+        "branches:string[]",
+        "committer_name",
+        "committer_email",
+        "committer_date:datetime",
+        "deletions:long",
+        "files:long",
+        "in_main_branch:boolean",
+        "insertions:long",
+        "lines:long",
+        "merge:boolean",
+        "msg",
+        "parents:string[]",
+        ":LABEL",
+    ],
+    "User": [":ID(User)", "name", "email", ":LABEL"],
+    "FileChange": [
+        ":ID(FileChange)",
+        "file_name",
+        "change_type",
+        "modify_in:datetime",
+        ":LABEL",
+    ],
+    "Feature": [
+        ":ID(Feature)",
+        "name",
+        "ident",
+        "add_from",
+        "add_by",
+        "delete_from",
+        "delete_by",
+        "modify_from",
+        "modify_by",
+        ":LABEL",
+    ],
+    "CanonicalFeature": ["name:ID(CanonicalFeature)", ":LABEL"],
+    # rollups of `aggregates.py`
+    "FileMonth": [
+        ":ID(FileMonth)",
+        "file_name",
+        "month",
+        "changes:long",
+        "add_feats:long",
+        "delete_feats:long",
+        "modify_feats:long",
+        ":LABEL",
+    ],
+    "FileStats": [
+        ":ID(FileStats)",
+        "file_name",
+        "changes:long",
+        "add_feats:long",
+        "delete_feats:long",
+        "modify_feats:long",
+        "last_change:datetime",
+        ":LABEL",
+    ],
+    "AuthorFeature": [
+        ":ID(AuthorFeature)",
+        "email",
+        "feature",
+        "add:long",
+        "delete:long",
+        "modify:long",
+        "last_change:datetime",
+        ":LABEL",
+    ],
+}
+
+ARRAY_DELIMITER = "\x1f"
+ARRAY_TYPES = {str: "string", bool: "boolean", int: "long", float: "double"}
+
+# relationship files by (start id space, end id space)
+REL_FILES = {
+    ("Commit", "Commit"): [],
+    ("User", "Commit"): ["date:datetime"],
+    ("Commit", "FileChange"): ["date:datetime"],
+    ("FileChange", "FileChange"): [],
+    ("FileChange", "Feature"): [],
+    ("Feature", "CanonicalFeature"): [],
+}
+
+
+def user_id(props: dict):
+    return f"{props['name']} <{props['email']}>"
+
+
+def file_change_id(props: dict):
+    return f"{props['change_type']}:{props['file_name']}@{csv_value(props['modify_in'])}"
+
+
+def feature_id(props: dict):
+    key = "\x1f".join(f"{k}={props[k]}" for k in sorted(props))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def aggregate_id(key: tuple):
+    return hashlib.sha1("\x1f".join(map(str, key)).encode("utf-8")).hexdigest()
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (list, tuple)):
+        return ARRAY_DELIMITER.join(str(csv_value(v)) for v in value)
+    return value
+
+
+def typed_header(header: list[str], props: dict) -> tuple[str, ...]:
+    """`header` with an array type for the untyped columns holding a list in `props`"""
+    typed = []
+    for h in header:
+        value = props.get(h)
+        if ":" not in h and isinstance(value, (list, tuple)):
+            h = f"{h}:{ARRAY_TYPES.get(type(value[0]), 'string') if value else 'string'}[]"
+        typed.append(h)
+    return tuple(typed)
+
+
+class AdminImportExporter:
+    """
+    collect commit subgraphs in memory, then write them as `neo4j-admin` CSV
+    files; features in `canonical` are linked to their CanonicalFeature
+    """
+
+    def __init__(self, canonical: dict = None):
+        self.nodes = {label: {} for label in NODE_HEADERS}
+        self.labels = defaultdict(set)
+        self.rels = {key: [] for key in REL_FILES}
+        self.lineage = PathLineage()
+        self.canonical = canonical or {}
+        self.aggregator = Aggregator()
+
+    def add_rel(self, start: tuple, end: tuple, rel_type: str, props: dict = None):
+        self.rels[(start[0], end[0])].append((start[1], end[1], rel_type, props or {}))
+
+    def add(self, subgraph: dict):
+        commit = subgraph["commit"]
+        commit_key = ("Commit", commit["name"])
+        self.nodes["Commit"][commit["name"]] = commit
+        for parent in subgraph["parents"]:
+            self.nodes["Commit"].setdefault(parent, {"name": parent})
+            self.add_rel(("Commit", parent), commit_key, "PARENT_OF")
+            self.add_rel(commit_key, ("Commit", parent), "CHILD_OF")
+        for user in subgraph["users"]:
+            uid = user_id(user["props"])
+            self.nodes["User"][uid] = user["props"]
+            self.labels[("User", uid)].update(user["labels"])
+            self.add_rel(("User", uid), commit_key, "COMMIT", {"date": user["date"]})
+        date = commit["committer_date"]
+        for fc in subgraph["file_changes"]:
+            props = fc["props"]
+            fcid = file_change_id(props)
+            self.nodes["FileChange"][fcid] = props
+            self.add_rel(
+                commit_key, ("FileChange", fcid), f"{props['change_type']}_FILE", {"date": date}
+            )
+            if fc["old_path"]:
+                # same as `commit2graph.write_subgraph`
+                old_id = self.lineage.get(fc["old_path"])
+                if old_id is None:
+                    print(f"no file change found for {fc['old_path']}, renamed to {props['file_name']}")
+                else:
+                    self.add_rel(("FileChange", fcid), ("FileChange", old_id), "RENAMED_FROM")
+                self.lineage.rename(fc["old_path"], props["file_name"], fcid)
+            else:
+                self.lineage.record(props["file_name"], fcid)
+            for kind, feat, ident in fc["features"]:
+                feat_props = {
+                    "name": feat,
+                    "ident": ident,
+                    f"{kind}_from": props["file_name"],
+                    f"{kind}_by": fcid,
+                }
+                feat_id = feature_id(feat_props)
+                self.nodes["Feature"][feat_id] = feat_props
+                self.add_rel(("FileChange", fcid), ("Feature", feat_id), FEAT_RELS[kind])
+                name = self.canonical.get(feature_key(feat, ident))
+                if name:
+                    self.nodes["CanonicalFeature"][name] = {"name": name}
+                    self.add_rel(
+                        ("Feature", feat_id), ("CanonicalFeature", name), "INSTANCE_OF"
+                    )
+        self.aggregator.add(subgraph, self.canonical)
+
+    def write(self, out_dir: str):
+        """write CSV files to `out_dir`, return the matching `neo4j-admin` command"""
+        makedirs(out_dir, exist_ok=True)
+        for label, rows in self.aggregator.rows.items():
+            self.nodes[label] = {aggregate_id(key): row for key, row in rows.items()}
+        args = []
+        for label, header in NODE_HEADERS.items():
+            columns = [h.split(":")[0] for h in header[1:-1]]
+            # one file per header, all in the id space of `label`
+            files = defaultdict(list)
+            for node_id, props in self.nodes[label].items():
+                files[typed_header(header, props)].append((node_id, props))
+            files = files or {tuple(header): []}
+            for i, (file_header, nodes) in enumerate(files.items()):
+                suffix = f"_{i}" if i else ""
+                fname = path.join(out_dir, f"nodes_{label}{suffix}.csv")
+                with open(fname, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(file_header)
+                    for node_id, props in nodes:
+                        labels = sorted(self.labels.get((label, node_id), [label]))
+                        writer.writerow(
+                            [node_id]
+                            + [csv_value(props.get(c)) for c in columns]
+                            + [ARRAY_DELIMITER.join(labels)]
+                        )
+                args.append(f"--nodes={fname}")
+                print(f"saving {len(nodes)} {label} nodes > {fname}")
+        for (start, end), prop_header in REL_FILES.items():
+            fname = path.join(out_dir, f"rels_{start}_{end}.csv")
+            columns = [h.split(":")[0] for h in prop_header]
+            with open(fname, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(
+                    [f":START_ID({start})", f":END_ID({end})", ":TYPE"] + prop_header
+                )
+                for start_id, end_id, rel_type, props in self.rels[(start, end)]:
+                    writer.writerow(
+                        [start_id, end_id, rel_type]
+                        + [csv_value(props.get(c)) for c in columns]
+                    )
+            args.append(f"--relationships={fname}")
+            print(f"saving {len(self.rels[(start, end)])} relationships > {fname}")
+        return (
+            "neo4j-admin database import full neo4j --overwrite-destination "
+            "--multiline-fields=true --array-delimiter=U+001F " + " ".join(args)
+        )
+
+
+def export_repo(repo_path: str, knowledge: dict, out_dir: str, canonical: dict = None):
+    index = CommitIndex(repo_path)
+    return export_records(
+        (
+            commit_record(commit, index)
+            for commit in Repository(repo_path).traverse_commits()
+            if commit.hash in knowledge
+        ),
+        knowledge,
+        out_dir,
+        canonical,
+    )
+
+
+def export_records(records, knowledge: dict, out_dir: str, canonical: dict = None):
+    """same as `export_repo` from commit records, e.g. of a metadata sidecar"""
+    exporter = AdminImportExporter(canonical)
+    for record in records:
+        exporter.add(commit_subgraph(record, knowledge[record["commit"]["name"]]))
+    return exporter.write(out_dir)
+
+
+if __name__ == "__main__":
+    WORK_DIR = path.dirname(__file__)
+    chdir(WORK_DIR)
+    if len(argv) > 2:
+        REPO_NAME, JSON_NAME = argv[1], argv[2]
+    else:
+        REPO_NAME = "grep-ast"
+        JSON_NAME = f"{REPO_NAME}_llama3-70b-8192_deepseek-v3_1744565333"
+    OUT_DIR = argv[3] if len(argv) > 3 else path.join("import", JSON_NAME)
+    REPO_PATH = path.join(WORK_DIR, path.pardir, "proj", REPO_NAME)
+    data = load_json(JSON_NAME)
+    canonical = canonical_for(JSON_NAME, data, float(getenv("DEDUP_THRESHOLD", THRESHOLD)))
+    if path.exists(JSON_NAME + ".meta.json"):
+        command = export_records(load_meta(JSON_NAME), data, OUT_DIR, canonical)
+    else:
+        command = export_repo(REPO_PATH, data, OUT_DIR, canonical)
+    print("stop neo4j, then run:\n" + command)
@@ -0,0 +1,199 @@
+"""usage: python graph_snapshot.py export|restore <FILE>
+
+Compact graph snapshots, e.g. to switch between the graphs of different
+analysis models of the same repository without re-ingesting: `export` streams
+the whole Neo4j database to FILE, `restore` empties it and loads FILE back
+through the batched write path.
+
+A snapshot is gzip compressed JSON lines: a header with the format version,
+then one line per node, `{"n": id, "l": labels, "p": properties}`, then one
+per relationship, `{"r": type, "s": start id, "e": end id, "p": properties}`.
+Ids are integers local to the file. Property values that are element ids of
+exported nodes (e.g. `Feature.add_by`) are stored as `{"$ref": id}` and
+datetimes as `{"$dt": iso}` / `{"$date": iso}`, so they survive the restore.
+The format is the same for `Neo4jDB` and `MemoryGraphDB`.
+"""
+import gzip
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from sys import argv
+from typing import Iterable
+
+VERSION = 1
+
+
+def _default(value):
+    # neo4j.time types
+    if hasattr(value, "to_native"):
+        value = value.to_native()
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"unsupported property value {value!r}")
+
+
+def _object_hook(obj: dict):
+    if len(obj) == 1:
+        if "$dt" in obj:
+            return datetime.fromisoformat(obj["$dt"])
+        if "$date" in obj:
+            return date.fromisoformat(obj["$date"])
+    return obj
+
+
+def _is_ref(value) -> bool:
+    return isinstance(value, dict) and "$ref" in value
+
+
+def write_snapshot(
+    file_name: str, element_ids: Iterable[str], nodes: Iterable[dict], rels: Iterable[dict]
+) -> tuple[int, int]:
+    """
+    write a snapshot of `nodes` and `rels`, node / relationship dicts as
+    returned by `Neo4jDB`; `element_ids` are the ids of all `nodes`, read
+    first so references can be resolved while streaming. Nodes created after
+    `element_ids` was read, and relationships touching them, are left out
+
+    :return: (number of nodes, number of relationships)
+    """
+    ids = {element_id: i for i, element_id in enumerate(element_ids)}
+
+    def encode(props: dict) -> dict:
+        return {
+            k: {"$ref": ids[v]} if isinstance(v, str) and v in ids else v
+            for k, v in props.items()
+        }
+
+    n_nodes, n_rels, skipped = 0, 0, 0
+    with gzip.open(file_name, "wt", encoding="utf-8", compresslevel=6) as f:
+        dump = lambda obj: f.write(json.dumps(obj, default=_default) + "\n")
+        dump({"version": VERSION})
+        for node in nodes:
+            if node["element_id"] not in ids:
+                skipped += 1
+                continue
+            dump({"n": ids[node["element_id"]], "l": node["labels"], "p": encode(node["properties"])})
+            n_nodes += 1
+        for rel in rels:
+            if rel["start_element_id"] not in ids or rel["end_element_id"] not in ids:
+                skipped += 1
+                continue
+            dump(
+                {
+                    "r": rel["type"],
+                    "s": ids[rel["start_element_id"]],
+                    "e": ids[rel["end_element_id"]],
+                    "p": rel["properties"],
+                }
+            )
+            n_rels += 1
+    if skipped:
+        print(f"skipped {skipped} nodes and relationships created during the export")
+    print(f"saving {n_nodes} nodes, {n_rels} relationships > {file_name}")
+    return n_nodes, n_rels
+
+
+def read_snapshot(file_name: str) -> Iterable[dict]:
+    """the node and relationship lines of a snapshot, values decoded"""
+    with gzip.open(file_name, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != VERSION:
+            raise ValueError(f"{file_name}: unsupported snapshot version {header.get('version')}")
+        for line in f:
+            yield json.loads(line, object_hook=_object_hook)
+
+
+def restore_snapshot(db, file_name: str, batch_size: int = None) -> dict[int, str]:
+    """
+    create the nodes and relationships of a snapshot in `db` with
+    `create_nodes_bulk` / `create_relationships_bulk`, `batch_size` rows per
+    statement; the graph is added to what `db` holds
+
+    nodes are grouped by labels, a node referring to nodes not created yet is
+    held back until a flush has created them
+
+    :return: snapshot id -> element id
+    """
+    batch_size = batch_size or db.batch_size
+    id_map = {}
+    groups = defaultdict(list)
+    held = []
+    rels = defaultdict(list)
+    n_rels = 0
+
+    def resolved(props: dict) -> bool:
+        return all(v["$ref"] in id_map for v in props.values() if _is_ref(v))
+
+    def flush_nodes(labels: tuple):
+        entries = groups.pop(labels)
+        rows = [
+            {k: id_map[v["$ref"]] if _is_ref(v) else v for k, v in e["p"].items()}
+            for e in entries
+        ]
+        element_ids = db.create_nodes_bulk(list(labels), rows, batch_size)
+        id_map.update((e["n"], element_id) for e, element_id in zip(entries, element_ids))
+
+    def add_node(entry: dict):
+        if not resolved(entry["p"]):
+            held.append(entry)
+            return
+        labels = tuple(entry["l"])
+        groups[labels].append(entry)
+        if len(groups[labels]) >= batch_size:
+            flush_nodes(labels)
+            release()
+
+    def release():
+        nonlocal held
+        ready = [e for e in held if resolved(e["p"])]
+        held = [e for e in held if not resolved(e["p"])]
+        for entry in ready:
+            add_node(entry)
+
+    def flush_all():
+        while groups:
+            for labels in list(groups):
+                flush_nodes(labels)
+            release()
+        if held:
+            raise ValueError(f"{file_name}: {len(held)} nodes refer to missing nodes")
+
+    def flush_rels(rel_type: str):
+        db.create_relationships_bulk(rel_type, rels.pop(rel_type), batch_size)
+
+    for entry in read_snapshot(file_name):
+        if "n" in entry:
+            add_node(entry)
+            continue
+        # relationships follow all nodes
+        if groups or held:
+            flush_all()
+        rels[entry["r"]].append(
+            {"from_id": id_map[entry["s"]], "to_id": id_map[entry["e"]], "properties": entry["p"]}
+        )
+        n_rels += 1
+        if len(rels[entry["r"]]) >= batch_size:
+            flush_rels(entry["r"])
+    flush_all()
+    for rel_type in list(rels):
+        flush_rels(rel_type)
+    print(f"restored {len(id_map)} nodes, {n_rels} relationships < {file_name}")
+    return id_map
+
+
+if __name__ == "__main__":
+    from db import Neo4jDB
+
+    COMMAND, FILE = argv[1], argv[2]
+    db = Neo4jDB()
+    try:
+        if COMMAND == "export":
+            db.export_snapshot(FILE)
+        elif COMMAND == "restore":
+            db.restore_snapshot(FILE, clear=True)
+        else:
+            raise SystemExit(__doc__)
+    finally:
+        db.close()
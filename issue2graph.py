@@ -0,0 +1,143 @@
+"""usage: python issue2graph.py <OWNER/REPO> <JSON_NAME> [CHATTED_JSON]
+
+Ingest the issues of `issues/<OWNER>_<REPO>_issues_merged.json`, with the
+`chat_issues.py` analysis in CHATTED_JSON when given (one entry per issue, in
+the same order), as `Issue` nodes, then link commits to the issues their
+messages reference: `FIXES` for `fixes #12` / `closes ...` / `resolves ...`,
+`REFERENCES` for any other `#12`, `owner/repo#12`, `GH-12` or issue / pull
+request URL. Every commit message is scanned once with a single combined
+regex and matches are resolved with a dict lookup, so linking is linear in
+the history whatever the number of issues.
+
+The graph may hold several repositories and `#12` is relative to the
+repository of the commit, so only the commits of the knowledge JSON
+`<JSON_NAME>.json` of `commit2graph.py` are linked. Links are merged, running
+again adds none twice.
+"""
+import json
+import re
+from os import path, chdir
+from sys import argv
+from typing import Iterable
+
+from db import Neo4jDB
+
+ISSUE_REF = re.compile(
+    r"(?:\b(?P<keyword>close[sd]?|fix(?:e[sd])?|resolve[sd]?)\s*:?\s+)?"
+    r"(?:https?://github\.com/(?P<url_repo>[\w.-]+/[\w.-]+)/(?:issues|pull)/"
+    r"|(?P<slug>[\w.-]+/[\w.-]+)#"
+    r"|(?<![\w&/])(?:#|GH-))"
+    r"(?P<number>\d+)\b",
+    re.IGNORECASE,
+)
+
+
+def issue_properties(owner_repo: str, issue: dict, analysis: dict = None):
+    """flat properties of an issue from the GitHub API, nested maps are not supported"""
+    props = {
+        "repo": owner_repo,
+        "number": issue["number"],
+        "title": issue["title"],
+        "state": issue["state"],
+        "url": issue["html_url"],
+        "user": issue["user"]["login"],
+        "labels": [l["name"] for l in issue["labels"]],
+        "created_at": issue["created_at"],
+        "closed_at": issue["closed_at"],
+        "pull_request": "pull_request" in issue,
+    }
+    if analysis:
+        # `chat_issues.ISSUE_PROMPT` answers with one of its categories as top heading
+        category = next(iter(analysis))
+        props["category"] = category
+        details = analysis[category]
+        if isinstance(details, dict) and isinstance(details.get("features"), list):
+            props["features"] = [str(f) for f in details["features"]]
+        props["analysis"] = json.dumps(analysis)
+    return props
+
+
+def write_issues(
+    db: Neo4jDB, owner_repo: str, issues: list[dict], analyses: list[dict] = None
+) -> dict[int, str]:
+    """merge issues in bulk, return issue number -> element id"""
+    analyses = analyses or [None] * len(issues)
+    rows = [issue_properties(owner_repo, i, a) for i, a in zip(issues, analyses)]
+    element_ids = db.merge_nodes_bulk("Issue", None, rows)
+    return {row["number"]: element_id for row, element_id in zip(rows, element_ids)}
+
+
+def scan_references(owner_repo: str, msg: str) -> Iterable[tuple[int, str]]:
+    """`(issue number, relationship type)` of every reference to `owner_repo` in `msg`"""
+    owner_repo = owner_repo.lower()
+    for m in ISSUE_REF.finditer(msg):
+        repo = m.group("url_repo") or m.group("slug")
+        if repo and repo.lower() != owner_repo:
+            continue
+        yield int(m.group("number")), "FIXES" if m.group("keyword") else "REFERENCES"
+
+
+def link_commits(
+    db: Neo4jDB,
+    owner_repo: str,
+    issue_ids: dict[int, str],
+    commits: set[str],
+    batch_size: int = 1000,
+):
+    """
+    stream all commits once and link those in `commits`, the hashes of
+    `owner_repo`, to the issues they reference
+    """
+    rels = {"FIXES": {}, "REFERENCES": {}}
+    cnt = 0
+
+    def flush():
+        for rel_type, rows in rels.items():
+            if rows:
+                db.create_relationships_bulk(rel_type, list(rows.values()), merge=True)
+                rows.clear()
+
+    for commit in db.iter_nodes("Commit"):
+        msg = commit["properties"].get("msg")
+        if not msg or commit["properties"].get("name") not in commits:
+            continue
+        found = {}
+        for number, rel_type in scan_references(owner_repo, msg):
+            if number in issue_ids and found.get(number) != "FIXES":
+                found[number] = rel_type
+        for number, rel_type in found.items():
+            rels[rel_type][(commit["element_id"], number)] = {
+                "from_id": commit["element_id"],
+                "to_id": issue_ids[number],
+            }
+            cnt += 1
+        if sum(len(rows) for rows in rels.values()) >= batch_size:
+            flush()
+    flush()
+    return cnt
+
+
+if __name__ == "__main__":
+    chdir(path.dirname(__file__))
+    if len(argv) > 2:
+        REPO, JSON_NAME = argv[1], argv[2]
+    else:
+        REPO = "Aider-AI/grep-ast"
+        JSON_NAME = "grep-ast_llama3-70b-8192_deepseek-v3_1744565333"
+    BASE_FNAME = REPO.replace("/", "_")
+    with open(path.join("issues", f"{BASE_FNAME}_issues_merged.json")) as f:
+        issues = json.load(f)
+    with open(JSON_NAME + ".json") as f:
+        commits = set(json.load(f))
+    analyses = None
+    if len(argv) > 3:
+        with open(argv[3]) as f:
+            analyses = json.load(f)
+    db = Neo4jDB()
+    try:
+        issue_ids = write_issues(db, REPO, issues, analyses)
+        print(f"merged {len(issue_ids)} issues")
+        cnt = link_commits(db, REPO, issue_ids, commits)
+        print(f"linked {cnt} commit -> issue references")
+    finally:
+        db.close()
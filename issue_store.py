@@ -0,0 +1,133 @@
+"""usage: python issue_store.py <REPO> <TOKEN>
+
+Incremental alternative to `github_issues.py`: only issues updated since the
+last sync are listed (`since=`), their comments fetched, and the result upserted
+by issue number into `<REPO>_issues.sqlite`, which is then exported to
+`<REPO>_issues_merged.json`.
+"""
+import json
+import sqlite3
+import requests
+from sys import argv
+from os import chdir, path, getenv
+
+from github_issues import iter_pages, fetch_issue_comments, save_to_json
+
+
+class IssueStore:
+    """issues with comments keyed by issue number, indexed on `updated_at`"""
+
+    def __init__(self, db_file: str):
+        self._conn = sqlite3.connect(db_file)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS issues (
+                number INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS issues_updated_at ON issues (updated_at);
+            """
+        )
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT count(*) FROM issues").fetchone()[0]
+
+    def last_updated_at(self) -> str | None:
+        return self._conn.execute("SELECT max(updated_at) FROM issues").fetchone()[0]
+
+    def upsert(self, issues: list[dict]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO issues (number, url, updated_at, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (number) DO UPDATE SET "
+                "url = excluded.url, updated_at = excluded.updated_at, data = excluded.data",
+                [
+                    (i["number"], i["url"], i["updated_at"], json.dumps(i))
+                    for i in issues
+                ],
+            )
+
+    def updated_at(self, number: int) -> str | None:
+        row = self._conn.execute(
+            "SELECT updated_at FROM issues WHERE number = ?", (number,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, number: int) -> dict | None:
+        row = self._conn.execute(
+            "SELECT data FROM issues WHERE number = ?", (number,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def issues(self):
+        """yield issues sorted by url descending, the order of `_issues_merged.json`"""
+        for (data,) in self._conn.execute("SELECT data FROM issues ORDER BY url DESC"):
+            yield json.loads(data)
+
+    def export_json(self, file_name: str):
+        save_to_json(file_name, list(self.issues()))
+
+
+def sync_repo_issues(
+    store: IssueStore, owner_repo: str, token: str, max_workers: int = 8
+):
+    """
+    upsert issues updated since the last sync into `store`, return the number of changed issues
+
+    pages are listed by `updated_at` ascending and stored one by one, so an
+    interrupted sync resumes from the last stored issue
+    """
+    url = f"https://api.github.com/repos/{owner_repo}/issues?state=all&sort=updated&direction=asc&per_page=100"
+    since = store.last_updated_at()
+    if since:
+        url += f"&since={since}"
+        print(f"Syncing issues updated since {since}")
+    cnt = 0
+    for page in iter_pages(url, token):
+        # `since` is inclusive, skip issues already stored at this version
+        page = [i for i in page if i["updated_at"] != store.updated_at(i["number"])]
+        issues, failed = fetch_issue_comments(page, token, max_workers)
+        if failed:
+            # keep `since` before the first failure so the next sync retries it
+            failed = set(failed)
+            first = next(i for i, issue in enumerate(page) if issue["url"] in failed)
+            ok = {issue["url"] for issue in page[:first]}
+            store.upsert([issue for issue in issues if issue["url"] in ok])
+            cnt += len(ok)
+            raise requests.exceptions.RequestException(
+                f"Stop syncing after {cnt} issues, failed: {sorted(failed)}"
+            )
+        store.upsert(issues)
+        cnt += len(issues)
+        print(f"Synced {cnt} issues")
+    return cnt
+
+
+if __name__ == "__main__":
+    chdir(path.dirname(__file__))
+    if len(argv) > 2:
+        REPO, TOKEN = argv[1], argv[2]
+    else:
+        REPO = input("Please enter Github repo (e.g. octocat/Hello-World): \n").strip()
+        github_api_key = getenv("github_api_key")
+        if github_api_key:
+            TOKEN = github_api_key
+        else:
+            TOKEN = input("Please enter Github token: \n").strip()
+    FNAME_BASE = REPO.replace("/", "_", 1)
+    STORE_FILE = FNAME_BASE + "_issues.sqlite"
+    MERGED_FILE = FNAME_BASE + "_issues_merged.json"
+
+    store = IssueStore(STORE_FILE)
+    try:
+        if sync_repo_issues(store, REPO, TOKEN) > 0 or not path.exists(MERGED_FILE):
+            store.export_json(MERGED_FILE)
+        else:
+            print(f"No issue changed since last sync, {MERGED_FILE} is up to date")
+    finally:
+        store.close()
@@ -0,0 +1,141 @@
+"""usage: python knowledge_index.py <JSON_NAME>...
+
+Random access to the commit knowledge JSON of `commits.py`. A sidecar
+`<JSON_NAME>.idx.json` maps every commit hash to the byte offset and length of
+its entry, `KnowledgeIndex` memory maps the JSON and decodes only the entries
+looked up, so several analyses of a large repository can be opened at once.
+The sidecar records the size and modification time of the JSON it indexes and
+is rebuilt when they no longer match.
+"""
+import json
+import mmap
+import re
+from collections.abc import Mapping
+from os import path, stat
+from sys import argv
+from typing import Iterable
+
+VERSION = 1
+_WS = re.compile(r"\s*")
+
+
+def index_file(file_name_no_ext: str) -> str:
+    return file_name_no_ext + ".idx.json"
+
+
+def _source_stamp(json_file: str) -> dict:
+    st = stat(json_file)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def scan_entries(data: bytes) -> Iterable[tuple[str, int, int]]:
+    """`(key, byte offset, byte length)` of every member of the top level JSON object in `data`"""
+    text = data.decode("utf-8")
+    decoder = json.JSONDecoder()
+    pos = _WS.match(text, 0).end()
+    if text[pos : pos + 1] != "{":
+        raise ValueError("top level JSON value is not an object")
+    pos += 1
+    # character positions are converted to byte offsets incrementally, the
+    # file may contain non ASCII characters
+    char_pos, byte_pos = 0, 0
+
+    def to_bytes(i: int) -> int:
+        nonlocal char_pos, byte_pos
+        byte_pos += len(text[char_pos:i].encode("utf-8"))
+        char_pos = i
+        return byte_pos
+
+    while True:
+        pos = _WS.match(text, pos).end()
+        if text[pos] == "}":
+            return
+        if text[pos] == ",":
+            pos = _WS.match(text, pos + 1).end()
+        key, pos = decoder.raw_decode(text, pos)
+        pos = _WS.match(text, pos).end()
+        if text[pos] != ":":
+            raise ValueError(f"expected ':' at character {pos}")
+        start = _WS.match(text, pos + 1).end()
+        _, pos = decoder.raw_decode(text, start)
+        offset = to_bytes(start)
+        yield key, offset, to_bytes(pos) - offset
+
+
+def build_index(file_name_no_ext: str) -> dict:
+    """index `<file_name_no_ext>.json` and save the sidecar"""
+    json_file = file_name_no_ext + ".json"
+    with open(json_file, "rb") as f:
+        entries = {key: [offset, length] for key, offset, length in scan_entries(f.read())}
+    index = {"version": VERSION, **_source_stamp(json_file), "entries": entries}
+    print(f"saving index of {len(entries)} entries > {index_file(file_name_no_ext)}")
+    with open(index_file(file_name_no_ext), "w") as fp:
+        json.dump(index, fp, separators=(",", ":"))
+    return index
+
+
+def load_index(file_name_no_ext: str) -> dict:
+    """the sidecar of `<file_name_no_ext>.json`, (re)built when missing or stale"""
+    try:
+        with open(index_file(file_name_no_ext)) as fp:
+            index = json.load(fp)
+    except FileNotFoundError:
+        return build_index(file_name_no_ext)
+    stamp = _source_stamp(file_name_no_ext + ".json")
+    if index.get("version") != VERSION or any(index.get(k) != v for k, v in stamp.items()):
+        return build_index(file_name_no_ext)
+    return index
+
+
+class KnowledgeIndex(Mapping):
+    """
+    read only mapping commit hash -> knowledge, each lookup decodes only its
+    entry from the memory mapped JSON; use `subset` rather than building a
+    dict to keep a selection lazy
+    """
+
+    def __init__(self, json_file: str, entries: dict[str, list[int]], mm: mmap.mmap = None):
+        self.json_file = json_file
+        self.entries = entries
+        if mm is None:
+            with open(json_file, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mm = mm
+
+    @classmethod
+    def open(cls, file_name_no_ext: str) -> "KnowledgeIndex":
+        return cls(file_name_no_ext + ".json", load_index(file_name_no_ext)["entries"])
+
+    def subset(self, keys: Iterable[str]) -> "KnowledgeIndex":
+        """the entries of `keys` only, sharing the memory map"""
+        return KnowledgeIndex(self.json_file, {k: self.entries[k] for k in keys}, self._mm)
+
+    def __getitem__(self, key: str):
+        offset, length = self.entries[key]
+        return json.loads(self._mm[offset : offset + length])
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    for JSON_NAME in argv[1:]:
+        if not path.exists(JSON_NAME + ".json"):
+            print(f"{JSON_NAME}.json not found")
+            continue
+        build_index(JSON_NAME)
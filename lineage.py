@@ -0,0 +1,89 @@
+import json
+from os import path
+
+
+class PathLineage:
+    """
+    Latest FileChange of every path and the path each one was renamed from.
+    What identifies a FileChange is up to the caller: `commit2graph` keeps its
+    MERGE key, `graph_import` its CSV id.
+
+    Maintained while ingesting so a rename resolves its predecessor with a dict
+    lookup. A child lineage (`child()`) records changes on top of its parent
+    without touching it, `commit()` applies them: used to keep the lineage in
+    step with a database transaction that may be retried or rolled back.
+    """
+
+    # 1 held database element ids, which do not survive a wipe or restore
+    VERSION = 2
+
+    def __init__(self, parent: "PathLineage" = None):
+        self.parent = parent
+        self.latest = {}
+        self.renamed_from = {}
+
+    def child(self) -> "PathLineage":
+        return PathLineage(self)
+
+    def commit(self):
+        """apply the changes of this child lineage to its parent"""
+        self.parent.latest.update(self.latest)
+        self.parent.renamed_from.update(self.renamed_from)
+        self.latest, self.renamed_from = {}, {}
+
+    def get(self, file_path: str):
+        """the latest FileChange of `file_path`"""
+        if file_path in self.latest:
+            return self.latest[file_path]
+        return self.parent.get(file_path) if self.parent else None
+
+    def previous_path(self, file_path: str) -> str | None:
+        if file_path in self.renamed_from:
+            return self.renamed_from[file_path]
+        return self.parent.previous_path(file_path) if self.parent else None
+
+    def record(self, file_path: str, file_change):
+        self.latest[file_path] = file_change
+
+    def rename(self, old_path: str, new_path: str, file_change):
+        self.latest[new_path] = file_change
+        self.renamed_from[new_path] = old_path
+
+    def chain(self, file_path: str) -> list[str]:
+        """`file_path` followed by the paths it was renamed from, newest first"""
+        paths = [file_path]
+        while (old := self.previous_path(paths[-1])) is not None and old not in paths:
+            paths.append(old)
+        return paths
+
+    def __len__(self):
+        return len(self.latest)
+
+    def save(self, file_name: str):
+        print(f"saving lineage of {len(self.latest)} paths > {file_name}")
+        with open(file_name, "w") as fp:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "latest": self.latest,
+                    "renamed_from": self.renamed_from,
+                },
+                fp,
+            )
+
+    @classmethod
+    def load(cls, file_name: str) -> "PathLineage":
+        """the lineage saved in `file_name`, an empty one if it does not exist"""
+        lineage = cls()
+        if not path.exists(file_name):
+            return lineage
+        with open(file_name) as fp:
+            data = json.load(fp)
+        if data.get("version") == 1:
+            print(f"{file_name}: discarding lineage of element ids, renames are resolved by path")
+            return lineage
+        if data.get("version") != cls.VERSION:
+            raise ValueError(f"{file_name}: unsupported version {data.get('version')}")
+        lineage.latest = data["latest"]
+        lineage.renamed_from = data["renamed_from"]
+        return lineage
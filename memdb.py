@@ -0,0 +1,535 @@
+import gzip
+import pickle
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+from typing import Callable, Union, List, Optional
+
+from db import Neo4jDB, merge_key
+from graph_snapshot import restore_snapshot, write_snapshot
+
+
+def _index_value(value):
+    """属性值转换为可作为索引键的形式，无法索引时返回 None"""
+    if isinstance(value, list):
+        value = tuple(value)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
+class MemoryGraphDB:
+    """
+    进程内图数据库，接口与 Neo4jDB 相同，用于离线试运行、性能分析和基准测试
+
+    节点按标签、(标签, 属性, 值) 建立索引，关系按类型索引并维护出边 / 入边邻接表；
+    不支持 Cypher，没有 execute_query / stream_query 方法；unit_of_work / write_transaction
+    中的修改记入日志，抛出异常时按日志回滚
+    """
+
+    VERSION = 1
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self._ids = count()
+        self._nodes = {}  # element_id -> {"labels": set, "properties": dict}
+        self._rels = {}  # element_id -> {"type", "properties", "start", "end"}
+        self._label_index = defaultdict(set)
+        self._prop_index = defaultdict(set)  # (label, key, value) -> element_ids
+        self._type_index = defaultdict(set)
+        self._out = defaultdict(set)
+        self._in = defaultdict(set)
+        self._journal = None  # 事务中为 [(类型, element_id, 修改前状态)]
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self._nodes)
+
+    # 索引维护
+    def _new_id(self, prefix: str):
+        return f"mem:{prefix}:{next(self._ids)}"
+
+    def _index_node(self, element_id: str, add: bool = True):
+        node = self._nodes[element_id]
+        for label in node["labels"]:
+            keys = [(label, k, _index_value(v)) for k, v in node["properties"].items()]
+            if add:
+                self._label_index[label].add(element_id)
+                for key in keys:
+                    if key[2] is not None:
+                        self._prop_index[key].add(element_id)
+            else:
+                self._label_index[label].discard(element_id)
+                for key in keys:
+                    if key[2] is not None:
+                        self._prop_index[key].discard(element_id)
+
+    def _link(self, element_id: str):
+        rel = self._rels[element_id]
+        self._type_index[rel["type"]].add(element_id)
+        self._out[rel["start"]].add(element_id)
+        self._in[rel["end"]].add(element_id)
+
+    def _record(self, kind: str, element_id: str):
+        """事务中记录节点（"n"）或关系（"r"）修改前的状态，新建的记为 None"""
+        if self._journal is None:
+            return
+        state = (self._nodes if kind == "n" else self._rels).get(element_id)
+        if state is not None:
+            state = dict(state, properties=dict(state["properties"]))
+            if kind == "n":
+                state["labels"] = set(state["labels"])
+        self._journal.append((kind, element_id, state))
+
+    def _rollback(self, journal: list):
+        """按日志逆序恢复修改前的状态"""
+        for kind, element_id, state in reversed(journal):
+            if kind == "r":
+                if element_id in self._rels:
+                    self._delete_relationship(element_id)
+                if state is not None:
+                    self._rels[element_id] = state
+                    self._link(element_id)
+                continue
+            if element_id in self._nodes:
+                self._index_node(element_id, add=False)
+                del self._nodes[element_id]
+            if state is not None:
+                self._nodes[element_id] = state
+                self._index_node(element_id)
+            elif not self._out.get(element_id) and not self._in.get(element_id):
+                self._out.pop(element_id, None)
+                self._in.pop(element_id, None)
+
+    def _candidates(self, labels: List[str], properties: dict = None):
+        """按索引取候选节点，再逐一过滤"""
+        sets = [self._label_index.get(label, set()) for label in labels]
+        for k, v in (properties or {}).items():
+            v = _index_value(v)
+            if v is not None and labels:
+                sets.append(self._prop_index.get((labels[0], k, v), set()))
+        if not sets:
+            ids = self._nodes.keys()
+        else:
+            sets.sort(key=len)
+            ids = sets[0].intersection(*sets[1:])
+        for element_id in list(ids):
+            node = self._nodes[element_id]
+            if all(node["properties"].get(k) == v for k, v in (properties or {}).items()):
+                yield element_id
+
+    def _convert_node(self, element_id: str) -> dict:
+        node = self._nodes[element_id]
+        return {
+            "element_id": element_id,
+            "labels": sorted(node["labels"]),
+            "properties": dict(node["properties"]),
+        }
+
+    def _convert_relationship(self, element_id: str) -> dict:
+        rel = self._rels[element_id]
+        return {
+            "element_id": element_id,
+            "type": rel["type"],
+            "properties": dict(rel["properties"]),
+            "start_element_id": rel["start"],
+            "end_element_id": rel["end"],
+        }
+
+    # 节点
+    def _create(self, labels: List[str], properties: dict) -> str:
+        element_id = self._new_id("n")
+        self._record("n", element_id)
+        self._nodes[element_id] = {"labels": set(labels), "properties": dict(properties)}
+        self._index_node(element_id)
+        return element_id
+
+    def _merge(self, labels: List[str], properties: dict, key_props: List[str] = None):
+        merge_labels, key_props, extra_labels = merge_key(labels, key_props, properties)
+        key = {k: properties.get(k) for k in key_props}
+        element_id = next(self._candidates(merge_labels, key), None)
+        if element_id is None:
+            return self._create(labels, properties)
+        self._record("n", element_id)
+        self._index_node(element_id, add=False)
+        node = self._nodes[element_id]
+        node["labels"].update(extra_labels)
+        node["properties"].update(properties)
+        self._index_node(element_id)
+        return element_id
+
+    def create_node(self, labels: Union[str, List[str]], properties: dict = None) -> dict:
+        if isinstance(labels, str):
+            labels = [labels]
+        return self._convert_node(self._create(labels, properties or {}))
+
+    def merge_node(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        key_props: List[str] = None,
+    ) -> dict:
+        if isinstance(labels, str):
+            labels = [labels]
+        return self._convert_node(self._merge(labels, properties or {}, key_props))
+
+    def create_nodes_bulk(
+        self, labels: Union[str, List[str]], rows: List[dict], batch_size: int = None
+    ) -> List[str]:
+        if isinstance(labels, str):
+            labels = [labels]
+        return [self._create(labels, row) for row in rows]
+
+    def merge_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: Optional[List[str]],
+        rows: List[dict],
+        batch_size: int = None,
+    ) -> List[str]:
+        if isinstance(labels, str):
+            labels = [labels]
+        return [self._merge(labels, row, key_props) for row in rows]
+
+    def increment_nodes_bulk(
+        self,
+        labels: Union[str, List[str]],
+        key_props: List[str],
+        rows: List[dict],
+        max_props: List[str] = None,
+        batch_size: int = None,
+    ) -> List[str]:
+        """见 Neo4jDB.increment_nodes_bulk"""
+        if isinstance(labels, str):
+            labels = [labels]
+        max_props = max_props or []
+        element_ids = []
+        for row in rows:
+            merge_labels, keys, _ = merge_key(labels, key_props, row)
+            key = {k: row.get(k) for k in keys}
+            element_id = next(self._candidates(merge_labels, key), None)
+            if element_id is None:
+                element_id = self._create(labels, key)
+            self._record("n", element_id)
+            self._index_node(element_id, add=False)
+            props = self._nodes[element_id]["properties"]
+            for k, v in row.items():
+                if k in key:
+                    continue
+                if k in max_props:
+                    props[k] = v if props.get(k) is None or v > props[k] else props[k]
+                else:
+                    props[k] = props.get(k, 0) + v
+            self._index_node(element_id)
+            element_ids.append(element_id)
+        return element_ids
+
+    def existing_keys(
+        self, label: str, key_prop: str, required_prop: str = None, values: list = None
+    ) -> set:
+        """见 Neo4jDB.existing_keys，给出 values 时只按索引查这些值"""
+        if values is None:
+            ids = self._label_index.get(label, ())
+        else:
+            ids = set().union(
+                *(self._prop_index.get((label, key_prop, _index_value(v)), ()) for v in values)
+            )
+        return {
+            node["properties"].get(key_prop)
+            for node in map(self._nodes.get, ids)
+            if required_prop is None or node["properties"].get(required_prop) is not None
+        }
+
+    def match_nodes(
+        self, labels: Union[str, List[str]], properties: dict = None, limit: int = None
+    ) -> list[dict]:
+        return list(self.iter_nodes(labels, properties, limit))
+
+    def iter_nodes(
+        self,
+        labels: Union[str, List[str]],
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        if isinstance(labels, str):
+            labels = [labels]
+        for i, element_id in enumerate(self._candidates(labels, properties)):
+            if limit and i >= limit:
+                return
+            yield self._convert_node(element_id)
+
+    def update_node(
+        self,
+        element_id: str,
+        properties: dict,
+        add_labels: List[str] = None,
+        remove_labels: List[str] = None,
+    ) -> dict:
+        self._record("n", element_id)
+        self._index_node(element_id, add=False)
+        node = self._nodes[element_id]
+        node["properties"].update(properties or {})
+        node["labels"].update(add_labels or [])
+        node["labels"].difference_update(remove_labels or [])
+        self._index_node(element_id)
+        return self._convert_node(element_id)
+
+    def delete_node(self, element_id: str):
+        """删除节点及其所有关系"""
+        if element_id not in self._nodes:
+            return
+        for rel_id in list(self._out[element_id] | self._in[element_id]):
+            self._delete_relationship(rel_id)
+        self._record("n", element_id)
+        self._index_node(element_id, add=False)
+        del self._nodes[element_id]
+        self._out.pop(element_id, None)
+        self._in.pop(element_id, None)
+
+    # 关系
+    def _relate(self, from_id: str, to_id: str, rel_type: str, properties: dict) -> str:
+        if from_id not in self._nodes or to_id not in self._nodes:
+            return None
+        element_id = self._new_id("r")
+        self._record("r", element_id)
+        self._rels[element_id] = {
+            "type": rel_type,
+            "properties": dict(properties or {}),
+            "start": from_id,
+            "end": to_id,
+        }
+        self._link(element_id)
+        return element_id
+
+    def _delete_relationship(self, element_id: str):
+        self._record("r", element_id)
+        rel = self._rels.pop(element_id)
+        self._type_index[rel["type"]].discard(element_id)
+        self._out[rel["start"]].discard(element_id)
+        self._in[rel["end"]].discard(element_id)
+
+    def create_relationship(
+        self, from_id: str, to_id: str, rel_type: str, properties: dict = None
+    ) -> dict:
+        element_id = self._relate(from_id, to_id, rel_type, properties)
+        if element_id is None:
+            raise ValueError(f"Node {from_id} or {to_id} not found")
+        return self._convert_relationship(element_id)
+
+    def create_relationships_bulk(
+        self, rel_type: str, rows: List[dict], batch_size: int = None, merge: bool = False
+    ) -> List[Optional[str]]:
+        if not merge:
+            return [
+                self._relate(row["from_id"], row["to_id"], rel_type, row.get("properties"))
+                for row in rows
+            ]
+        element_ids = []
+        for row in rows:
+            element_id = next(
+                (
+                    r
+                    for r in self._out.get(row["from_id"], ())
+                    if self._rels[r]["type"] == rel_type and self._rels[r]["end"] == row["to_id"]
+                ),
+                None,
+            )
+            if element_id is None:
+                element_id = self._relate(
+                    row["from_id"], row["to_id"], rel_type, row.get("properties")
+                )
+            else:
+                self._record("r", element_id)
+                self._rels[element_id]["properties"] = dict(row.get("properties") or {})
+            element_ids.append(element_id)
+        return element_ids
+
+    def find_relationships(
+        self,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+    ) -> List[dict]:
+        return list(
+            self.iter_relationships(from_labels, to_labels, rel_type, properties, limit)
+        )
+
+    def iter_relationships(
+        self,
+        from_labels: Union[str, List[str]] = None,
+        to_labels: Union[str, List[str]] = None,
+        rel_type: str = None,
+        properties: dict = None,
+        limit: int = None,
+        fetch_size: int = 1000,
+    ):
+        from_labels = {from_labels} if isinstance(from_labels, str) else set(from_labels or [])
+        to_labels = {to_labels} if isinstance(to_labels, str) else set(to_labels or [])
+        rel_ids = self._type_index.get(rel_type, set()) if rel_type else self._rels.keys()
+        cnt = 0
+        for rel_id in list(rel_ids):
+            rel = self._rels[rel_id]
+            if not from_labels <= self._nodes[rel["start"]]["labels"]:
+                continue
+            if not to_labels <= self._nodes[rel["end"]]["labels"]:
+                continue
+            if any(rel["properties"].get(k) != v for k, v in (properties or {}).items()):
+                continue
+            if limit and cnt >= limit:
+                return
+            cnt += 1
+            yield {
+                "relationship": self._convert_relationship(rel_id),
+                "from_node": self._convert_node(rel["start"]),
+                "to_node": self._convert_node(rel["end"]),
+            }
+
+    def copy_node_and_relations(self, element_id: str, update_props: dict = None) -> dict:
+        """复制节点标签、属性、相连关系"""
+        if element_id not in self._nodes:
+            raise ValueError(f"Node with elementId {element_id} not found")
+        node = self._nodes[element_id]
+        new_id = self._create(
+            list(node["labels"]), dict(node["properties"], **(update_props or {}))
+        )
+        for rel_id in list(self._out[element_id]):
+            rel = self._rels[rel_id]
+            self._relate(new_id, rel["end"], rel["type"], rel["properties"])
+        for rel_id in list(self._in[element_id]):
+            rel = self._rels[rel_id]
+            self._relate(rel["start"], new_id, rel["type"], rel["properties"])
+        return self._convert_node(new_id)
+
+    # 与 Neo4jDB 接口兼容的事务和模式方法
+    def setup_schema(self, schema: List[str] = None):
+        pass
+
+    @contextmanager
+    def unit_of_work(self):
+        """嵌套时并入外层事务；抛出异常时回滚本事务的全部修改"""
+        if self._journal is not None:
+            yield self
+            return
+        self._journal = []
+        try:
+            yield self
+        except BaseException:
+            journal, self._journal = self._journal, None
+            self._rollback(journal)
+            raise
+        finally:
+            self._journal = None
+
+    def write_transaction(self, work: Callable, *args, **kwargs):
+        with self.unit_of_work():
+            return work(self, *args, **kwargs)
+
+    def delete_all(self):
+        """删除全部节点和关系，事务中逐个删除以便回滚"""
+        if self._journal is None:
+            self.__init__(self.batch_size)
+            return
+        for element_id in list(self._nodes):
+            self.delete_node(element_id)
+
+    # 快照
+    def save(self, file_name: str):
+        """保存快照（gzip 压缩的 pickle）"""
+        with gzip.open(file_name, "wb") as f:
+            pickle.dump(
+                {
+                    "version": self.VERSION,
+                    "next_id": next(self._ids),
+                    "nodes": self._nodes,
+                    "rels": self._rels,
+                },
+                f,
+            )
+        print(f"saving {len(self._nodes)} nodes, {len(self._rels)} relationships > {file_name}")
+
+    def export_snapshot(self, file_name: str, fetch_size: int = 1000) -> tuple:
+        """与 Neo4jDB.export_snapshot 格式相同的快照，可由 Neo4jDB.restore_snapshot 恢复"""
+        return write_snapshot(
+            file_name,
+            self._nodes,
+            map(self._convert_node, self._nodes),
+            map(self._convert_relationship, self._rels),
+        )
+
+    def restore_snapshot(
+        self, file_name: str, batch_size: int = None, clear: bool = False
+    ) -> dict:
+        """见 Neo4jDB.restore_snapshot"""
+        if clear:
+            self.delete_all()
+        return restore_snapshot(self, file_name, batch_size)
+
+    @classmethod
+    def load(cls, file_name: str) -> "MemoryGraphDB":
+        """从快照恢复，重建索引"""
+        with gzip.open(file_name, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported snapshot version: {state.get('version')}")
+        db = cls()
+        db._ids = count(state["next_id"])
+        db._nodes = state["nodes"]
+        for element_id in db._nodes:
+            db._index_node(element_id)
+        for element_id, rel in state["rels"].items():
+            db._rels[element_id] = rel
+            db._link(element_id)
+        return db
+
+    def push(self, db: Neo4jDB) -> dict:
+        """
+        将全部节点和关系批量写入 Neo4j（使用 CREATE，应写入空库），返回内存ID到 Neo4j 元素ID的映射
+
+        属性值为本库节点ID的（如 Feature.add_by）替换为对应的 Neo4j 元素ID
+        """
+        groups = defaultdict(list)
+        for element_id, node in self._nodes.items():
+            groups[tuple(sorted(node["labels"]))].append(element_id)
+
+        def refs(element_id):
+            props = self._nodes[element_id]["properties"]
+            return [v for v in props.values() if isinstance(v, str) and v in self._nodes]
+
+        def remap(element_id):
+            return {
+                k: id_map.get(v, v) if isinstance(v, str) else v
+                for k, v in self._nodes[element_id]["properties"].items()
+            }
+
+        id_map = {}
+        with db.unit_of_work():
+            # 被引用的节点先写入，引用方写入时即可替换为新ID
+            while groups:
+                ready = [
+                    labels
+                    for labels, ids in groups.items()
+                    if all(r in id_map for i in ids for r in refs(i))
+                ] or list(groups)
+                for labels in ready:
+                    ids = groups.pop(labels)
+                    new_ids = db.create_nodes_bulk(list(labels), [remap(i) for i in ids])
+                    id_map.update(zip(ids, new_ids))
+            for rel_type, rel_ids in self._type_index.items():
+                rows = [
+                    {
+                        "from_id": id_map[self._rels[r]["start"]],
+                        "to_id": id_map[self._rels[r]["end"]],
+                        "properties": self._rels[r]["properties"],
+                    }
+                    for r in rel_ids
+                ]
+                db.create_relationships_bulk(rel_type, rows)
+        print(f"pushed {len(self._nodes)} nodes, {len(self._rels)} relationships")
+        return id_map
@@ -0,0 +1,134 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+# end of stream marker passed downstream once a stage is exhausted
+_DONE = object()
+
+
+class StageStats:
+    """throughput counters of one stage, `busy` excludes time spent waiting on queues"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+        self.start = perf_counter()
+        self.end = None
+
+    @property
+    def elapsed(self):
+        return (self.end or perf_counter()) - self.start
+
+    @property
+    def busy(self):
+        return max(0.0, self.elapsed - self.wait_in - self.wait_out)
+
+    def __str__(self):
+        elapsed = self.elapsed or 1e-9
+        return (
+            f"{self.name}: {self.items} out, {self.items / elapsed:.1f}/s, "
+            f"busy {self.busy / elapsed:.0%}, "
+            f"starved {self.wait_in / elapsed:.0%}, blocked {self.wait_out / elapsed:.0%}"
+        )
+
+
+def batched(items: Iterable, n: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_pipeline(
+    source: tuple[str, Iterable],
+    *stages: tuple[str, Callable[[Iterator], Iterable]],
+    maxsize: int = 64,
+    report_every: float = 10,
+) -> list[StageStats]:
+    """
+    run `source` and every stage in its own thread, connected by queues of `maxsize` items
+
+    a stage is `(name, work)`, where `work(inputs)` consumes the iterator of the
+    previous stage's outputs and yields its own, so it can filter, batch or
+    fan out; outputs of the last stage are discarded. a full queue blocks its
+    producer (backpressure), the stage mostly `blocked` is waiting on a slower
+    one downstream, the one mostly `busy` is the bottleneck. the first error
+    of any stage stops the pipeline and is raised here
+    """
+    stop = Event()
+    errors = []
+    names = [source[0]] + [name for name, _ in stages]
+    stats = [StageStats(name) for name in names]
+    queues = [Queue(maxsize) for _ in stages]
+
+    def put(queue: Queue, item, stat: StageStats):
+        start = perf_counter()
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                break
+            except Full:
+                pass
+        stat.wait_out += perf_counter() - start
+
+    def receive(queue: Queue, stat: StageStats):
+        while True:
+            start = perf_counter()
+            item = _DONE
+            while not stop.is_set():
+                try:
+                    item = queue.get(timeout=0.5)
+                    break
+                except Empty:
+                    pass
+            stat.wait_in += perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def run(i: int, outputs: Iterable):
+        stat = stats[i]
+        out = queues[i] if i < len(queues) else None
+        try:
+            for item in outputs:
+                stat.items += 1
+                if out is not None:
+                    put(out, item, stat)
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stat.end = perf_counter()
+            if out is not None:
+                put(out, _DONE, stat)
+
+    threads = [Thread(target=run, args=(0, source[1]), name=names[0], daemon=True)]
+    for i, (name, work) in enumerate(stages, 1):
+        threads.append(
+            Thread(
+                target=run,
+                args=(i, work(receive(queues[i - 1], stats[i]))),
+                name=name,
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(report_every)
+            if thread.is_alive():
+                print(" | ".join(str(s) for s in stats))
+    print(" | ".join(str(s) for s in stats))
+    if errors:
+        raise errors[0]
+    return stats
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("neo4j")
+
+from issue2graph import link_commits, scan_references
+from memdb import MemoryGraphDB
+
+
+def refs(msg: str, owner_repo: str = "a/b"):
+    return list(scan_references(owner_repo, msg))
+
+
+@pytest.mark.parametrize(
+    "msg, expected",
+    [
+        ("fixes #12", [(12, "FIXES")]),
+        ("Closes: #7", [(7, "FIXES")]),
+        ("resolved GH-5", [(5, "FIXES")]),
+        ("see #12", [(12, "REFERENCES")]),
+        # closing keywords inside other words are plain references
+        ("prefix #12", [(12, "REFERENCES")]),
+        ("suffixed #3", [(3, "REFERENCES")]),
+        ("encloses #4", [(4, "REFERENCES")]),
+        ("fix https://github.com/a/b/issues/8", [(8, "FIXES")]),
+        ("a/b#9 and A/B#10", [(9, "REFERENCES"), (10, "REFERENCES")]),
+    ],
+)
+def test_scan_references(msg, expected):
+    assert refs(msg) == expected
+
+
+def test_other_repo_references_are_ignored():
+    assert refs("fixes other/repo#3") == []
+    assert refs("see https://github.com/other/repo/pull/3") == []
+    assert refs("fixes other/repo#3, see #4") == [(4, "REFERENCES")]
+
+
+def test_no_reference_inside_words_or_entities():
+    assert refs("abc#12 &#39; path/#3") == []
+
+
+def test_link_commits_of_the_repo_once():
+    db = MemoryGraphDB()
+    db.create_node("Commit", {"name": "c1", "msg": "fixes #1, see #2"})
+    # same numbers in a commit of another repository
+    db.create_node("Commit", {"name": "c2", "msg": "fixes #1"})
+    issue_ids = {
+        n: db.create_node("Issue", {"repo": "a/b", "number": n})["element_id"] for n in (1, 2)
+    }
+    for _ in range(2):
+        assert link_commits(db, "a/b", issue_ids, {"c1"}) == 2
+    links = [
+        (
+            r["relationship"]["type"],
+            r["from_node"]["properties"]["name"],
+            r["to_node"]["properties"]["number"],
+        )
+        for r in db.find_relationships()
+    ]
+    assert sorted(links) == [("FIXES", "c1", 1), ("REFERENCES", "c1", 2)]